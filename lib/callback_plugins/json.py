@@ -28,6 +28,78 @@ DOCUMENTATION = """
           - key: show_custom_stats
             section: defaults
         type: bool
+      json_lines:
+        name: Stream JSON Lines
+        description:
+          - Instead of writing a single JSON document at the end of the run, write one compact
+            JSON object per line for each event as it happens, so that the output can be followed
+            (e.g., with tail or a log shipper) while the run is in progress.
+          - Each line has an C(event) key, which is C(play_start) (with C(play)),
+            C(task_result) (with C(play), C(task), C(host), and C(result)), or C(stats)
+            (with C(stats), C(custom_stats), and C(global_custom_stats)) at the end.
+          - Results are written out as they arrive rather than kept until the end.
+        default: False
+        env:
+          - name: ANSIBLE_JSON_LINES
+        ini:
+          - key: json_lines
+            section: callback_json
+        type: bool
+      profile:
+        name: Include a timing profile
+        description:
+          - Add a C(profile) section to the output (or to the C(stats) event, with json_lines),
+            computed from durations measured with a monotonic clock.
+          - It lists the slowest tasks (C(tasks)), the time each host spent in each role
+            (C(roles)), the slowest host for each task that ran in lockstep, i.e., under the
+            linear strategy (C(stragglers)), and the time each host spent waiting for the others
+            to finish such tasks (C(lockstep_idle)).
+        default: False
+        env:
+          - name: ANSIBLE_JSON_PROFILE
+        ini:
+          - key: profile
+            section: callback_json
+        type: bool
+      profile_top:
+        name: Number of tasks to list in the profile
+        description: The number of slowest tasks and of stragglers to list in the profile.
+        default: 10
+        env:
+          - name: ANSIBLE_JSON_PROFILE_TOP
+        ini:
+          - key: profile_top
+            section: callback_json
+        type: int
+      result_rules:
+        name: Result filtering rules
+        description:
+          - A JSON object that maps module names (or C(*), for any other module) to rules that
+            reduce the results recorded for them. Each rule may specify C(keep), a list of the
+            only keys to keep; C(drop), a list of keys to remove; and C(max_string), the maximum
+            size in bytes of any string in the result (longer strings are truncated).
+          - 'For example, C({"cluster_discovery": {"keep": ["changed", "failed", "msg"]},
+            "*": {"max_string": 4096}}).'
+        default: ''
+        env:
+          - name: ANSIBLE_JSON_RESULT_RULES
+        ini:
+          - key: result_rules
+            section: callback_json
+        type: str
+      host_budget:
+        name: Result size budget per host
+        description:
+          - If set, once the results recorded for a host add up to this many bytes (as JSON),
+            only the changed, failed, skipped, unreachable, msg, and rc keys are kept from any
+            further results for that host, and C(budget_exceeded) is set in them.
+        default: 0
+        env:
+          - name: ANSIBLE_JSON_HOST_BUDGET
+        ini:
+          - key: host_budget
+            section: callback_json
+        type: int
     notes:
       - When using a strategy such as free, host_pinned, or a custom strategy, host results will
         be added to new task results in ``.plays[].tasks[]``. As such, there will exist duplicate
@@ -37,6 +109,9 @@ DOCUMENTATION = """
 
 import datetime
 import json
+import time
+
+from collections import OrderedDict
 
 from functools import partial
 
@@ -48,11 +123,61 @@ from ansible.plugins.callback import CallbackBase
 
 LOCKSTEP_CALLBACKS = frozenset(("linear", "debug"))
 
+SUMMARY_KEYS = ("changed", "failed", "skipped", "unreachable", "msg", "rc")
+
 
 def current_time():
     return "%sZ" % datetime.datetime.utcnow().isoformat()
 
 
+def parse_result_rules(text):
+    """Parse and validate the result_rules option"""
+    if not text:
+        return {}
+    rules = json.loads(text)
+    if not isinstance(rules, dict) or not all(
+        isinstance(rule, dict) and set(rule) <= {"keep", "drop", "max_string"}
+        for rule in rules.values()
+    ):
+        raise ValueError(
+            "expected an object mapping module names to rules with keep, drop, "
+            "or max_string"
+        )
+    return rules
+
+
+def truncate_strings(value, limit):
+    """Return a copy of the given value with any strings longer than limit
+    bytes truncated, or the value itself if nothing needed to be truncated"""
+    if isinstance(value, str):
+        encoded = value.encode("utf-8")
+        if len(encoded) <= limit:
+            return value
+        kept = encoded[:limit].decode("utf-8", "ignore")
+        return "%s... (%d bytes truncated)" % (
+            kept,
+            len(encoded) - len(kept.encode("utf-8")),
+        )
+    elif isinstance(value, dict):
+        return dict((k, truncate_strings(v, limit)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [truncate_strings(v, limit) for v in value]
+    return value
+
+
+def filter_result(result, rule):
+    """Return a copy of the given result reduced according to the given rule"""
+    keep = rule.get("keep")
+    drop = rule.get("drop") or ()
+    if keep is not None:
+        filtered = dict((k, v) for k, v in result.items() if k in keep)
+    else:
+        filtered = dict((k, v) for k, v in result.items() if k not in drop)
+    if rule.get("max_string"):
+        filtered = truncate_strings(filtered, rule["max_string"])
+    return filtered
+
+
 class CallbackModule(CallbackBase):
     CALLBACK_VERSION = 2.0
     CALLBACK_TYPE = "stdout"
@@ -63,6 +188,42 @@ class CallbackModule(CallbackBase):
         self.results = []
         self._task_map = {}
         self._is_lockstep = False
+        self._profile = OrderedDict()
+        self._host_start = {}
+        self._result_rules = {}
+        self._host_bytes = {}
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super(CallbackModule, self).set_options(
+            task_keys=task_keys, var_options=var_options, direct=direct
+        )
+        try:
+            self._result_rules = parse_result_rules(self.get_option("result_rules"))
+        except ValueError as e:
+            self._display.warning("Ignoring invalid json result_rules: %s" % e)
+            self._result_rules = {}
+
+    def _reduce_result(self, host, action, result):
+        """Apply any matching result_rules and the per-host size budget to the
+        given result, and return a copy"""
+        rules = self._result_rules
+        rule = rules.get(action, rules.get(action.rsplit(".", 1)[-1], rules.get("*")))
+        if rule:
+            result = filter_result(result, rule)
+        else:
+            result = result.copy()
+
+        budget = self.get_option("host_budget")
+        if budget:
+            used = self._host_bytes.get(host, 0)
+            if used >= budget:
+                result = dict((k, v) for k, v in result.items() if k in SUMMARY_KEYS)
+                result["budget_exceeded"] = True
+            else:
+                size = len(json.dumps(result, cls=AnsibleJSONEncoder))
+                self._host_bytes[host] = used + size
+
+        return result
 
     def _new_play(self, play):
         self._is_lockstep = play.strategy in LOCKSTEP_CALLBACKS
@@ -85,14 +246,109 @@ class CallbackModule(CallbackBase):
             "hosts": {},
         }
 
+    def _emit(self, event):
+        """Write a single event as one line of compact JSON"""
+        self._display.display(
+            json.dumps(
+                event, cls=AnsibleJSONEncoder, sort_keys=True, separators=(",", ":")
+            )
+        )
+
+    def _profile_task(self, task):
+        """Return the timing record for the given task in the current play"""
+        play = self.results[-1]["play"]
+        key = (play["id"], task._uuid)
+        record = self._profile.get(key)
+        if record is None:
+            role = getattr(task, "_role", None)
+            record = {
+                "name": task.get_name(),
+                "id": to_text(task._uuid),
+                "play": play["name"],
+                "role": role.get_name() if role else None,
+                "lockstep": self._is_lockstep,
+                "start": time.monotonic(),
+                "end": None,
+                "hosts": {},
+            }
+            self._profile[key] = record
+        return record
+
+    def _build_profile(self):
+        """Summarise the timing records for v2_playbook_on_stats"""
+        top = self.get_option("profile_top")
+
+        tasks = []
+        roles = {}
+        stragglers = []
+        idle = {}
+
+        for record in self._profile.values():
+            hosts = record["hosts"]
+            if not hosts:
+                continue
+
+            task = {"name": record["name"], "id": record["id"], "play": record["play"]}
+            tasks.append(
+                dict(
+                    task,
+                    role=record["role"],
+                    duration=round(record["end"] - record["start"], 3),
+                    hosts=len(hosts),
+                )
+            )
+
+            for host, duration in hosts.items():
+                host_roles = roles.setdefault(host, {})
+                role = record["role"] or "(none)"
+                host_roles[role] = host_roles.get(role, 0) + duration
+
+            # Under a lockstep strategy, no host can start the next task until
+            # every host has finished this one, so each one waits for the
+            # slowest host (the straggler).
+            if record["lockstep"] and len(hosts) > 1:
+                slowest = max(hosts, key=hosts.get)
+                waits = dict((h, hosts[slowest] - d) for h, d in hosts.items())
+                for host, wait in waits.items():
+                    idle[host] = idle.get(host, 0) + wait
+                stragglers.append(
+                    dict(
+                        task,
+                        host=slowest,
+                        duration=round(hosts[slowest], 3),
+                        idle=round(sum(waits.values()), 3),
+                    )
+                )
+
+        tasks.sort(key=lambda t: t["duration"], reverse=True)
+        stragglers.sort(key=lambda t: t["idle"], reverse=True)
+
+        return {
+            "tasks": tasks[:top],
+            "roles": dict(
+                (host, dict((r, round(d, 3)) for r, d in host_roles.items()))
+                for host, host_roles in roles.items()
+            ),
+            "stragglers": stragglers[:top],
+            "lockstep_idle": {
+                "hosts": dict((h, round(d, 3)) for h, d in idle.items()),
+                "total": round(sum(idle.values()), 3),
+            },
+        }
+
     def _find_result_task(self, host, task):
         key = (host.get_name(), task._uuid)
         return self._task_map.get(key, self.results[-1]["tasks"][-1])
 
     def v2_playbook_on_play_start(self, play):
         self.results.append(self._new_play(play))
+        if self.get_option("json_lines"):
+            self._emit({"event": "play_start", "play": self.results[-1]["play"]})
 
     def v2_runner_on_start(self, host, task):
+        if self.get_option("profile"):
+            self._profile_task(task)
+            self._host_start[(host.get_name(), task._uuid)] = time.monotonic()
         if self._is_lockstep:
             return
         key = (host.get_name(), task._uuid)
@@ -104,11 +360,15 @@ class CallbackModule(CallbackBase):
         if not self._is_lockstep:
             return
         self.results[-1]["tasks"].append(self._new_task(task))
+        if self.get_option("profile"):
+            self._profile_task(task)
 
     def v2_playbook_on_handler_task_start(self, task):
         if not self._is_lockstep:
             return
         self.results[-1]["tasks"].append(self._new_task(task))
+        if self.get_option("profile"):
+            self._profile_task(task)
 
     def _convert_host_to_name(self, key):
         if isinstance(key, (Host,)):
@@ -143,6 +403,15 @@ class CallbackModule(CallbackBase):
             "global_custom_stats": global_custom_stats,
         }
 
+        if self.get_option("profile"):
+            output["profile"] = self._build_profile()
+
+        if self.get_option("json_lines"):
+            del output["plays"]
+            output["event"] = "stats"
+            self._emit(output)
+            return
+
         self._display.display(
             json.dumps(output, cls=AnsibleJSONEncoder, indent=4, sort_keys=True)
         )
@@ -152,7 +421,7 @@ class CallbackModule(CallbackBase):
         host = result._host
         task = result._task
 
-        result_copy = result._result.copy()
+        result_copy = self._reduce_result(host.name, task.action, result._result)
         result_copy.update(on_info)
         result_copy["action"] = task.action
         if result_copy.get("failed", False) and kwargs.get("ignore_errors", False):
@@ -160,11 +429,32 @@ class CallbackModule(CallbackBase):
 
         task_result = self._find_result_task(host, task)
 
-        task_result["hosts"][host.name] = result_copy
+        if self.get_option("profile"):
+            record = self._profile_task(task)
+            now = time.monotonic()
+            start = self._host_start.pop((host.get_name(), task._uuid), None)
+            record["hosts"][host.name] = now - (start or record["start"])
+            record["end"] = now
+
         end_time = current_time()
         task_result["task"]["duration"]["end"] = end_time
         self.results[-1]["play"]["duration"]["end"] = end_time
 
+        # In streaming mode, we write out the result at once instead of
+        # keeping it, and keep only the play and task skeletons.
+        if self.get_option("json_lines"):
+            self._emit(
+                {
+                    "event": "task_result",
+                    "play": self.results[-1]["play"],
+                    "task": task_result["task"],
+                    "host": host.name,
+                    "result": result_copy,
+                }
+            )
+        else:
+            task_result["hosts"][host.name] = result_copy
+
         if not self._is_lockstep:
             key = (host.get_name(), task._uuid)
             del self._task_map[key]
@@ -3,7 +3,12 @@
 # © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
 
 import base64
+import collections
 import hashlib
+import multiprocessing
+import os
+import struct
+import threading
 from hmac import HMAC
 from ansible.errors import AnsibleFilterError
 
@@ -25,14 +30,66 @@ def md5_password(password, username):
     )
 
 
+# The PBKDF2 derivation in scram_password() is deliberately expensive, and the
+# same verifier is computed over and over again when templates that use the
+# filter are evaluated repeatedly, so we remember the most recently computed
+# verifiers, keyed on a digest of (password, salt, rounds) rather than on the
+# password itself. We cache only verifiers with an explicit salt (i.e., taken
+# from an existing verifier); otherwise every call must generate a new salt,
+# so that users with the same password do not get identical verifiers.
+
+SCRAM_CACHE_SIZE = 1024
+scram_cache = collections.OrderedDict()
+scram_cache_lock = threading.Lock()
+
+
+def scram_cache_key(password, salt, rounds):
+    h = hashlib.sha256()
+    for part in (password.encode("utf-8"), salt, str(rounds).encode("ascii")):
+        h.update(struct.pack(">I", len(part)) + part)
+    return h.digest()
+
+
+def scram_cache_get(key):
+    with scram_cache_lock:
+        verifier = scram_cache.get(key)
+        if verifier is not None:
+            scram_cache.move_to_end(key)
+        return verifier
+
+
+def scram_cache_put(key, verifier):
+    with scram_cache_lock:
+        scram_cache[key] = verifier
+        while len(scram_cache) > SCRAM_CACHE_SIZE:
+            scram_cache.popitem(last=False)
+
+
+def scram_password(password, salt=None, rounds=4096):
+    if salt is None:
+        return scram_verifier(password, salt=salt, rounds=rounds)
+
+    key = scram_cache_key(password, salt, rounds)
+    verifier = scram_cache_get(key)
+    if verifier is None:
+        verifier = scram_verifier(password, salt=salt, rounds=rounds)
+        scram_cache_put(key, verifier)
+    return verifier
+
+
 # Returns ``SCRAM-SHA-256$<iteration count>:<salt>$<StoredKey>:<ServerKey>`` as
 # computed by scram_build_verifier() in src/common/scram-common.c
 
 
-def scram_password(password, salt=None, rounds=4096):
-    s = scram.using(rounds=rounds, salt=salt, algs="sha-1,sha-256").hash(password)
+def scram_verifier(password, salt=None, rounds=4096):
+    if salt is None:
+        salt = os.urandom(scram.default_salt_size)
+    if rounds is None:
+        rounds = scram.default_rounds
 
-    (salt, rounds, SaltedPassword) = scram.extract_digest_info(s, "sha-256")
+    # We derive only the SHA-256 SaltedPassword, which is all we need, rather
+    # than calling scram.hash(), which insists on deriving SHA-1 as well.
+    SaltedPassword = scram.derive_digest(password, salt, rounds, "sha-256")
 
     ClientKey = HMAC(
         SaltedPassword, "Client Key".encode("ascii"), hashlib.sha256
@@ -51,6 +108,19 @@ def scram_password(password, salt=None, rounds=4096):
     )
 
 
+# Returns the (salt, rounds) from an existing SCRAM-SHA-256 verifier, so that we
+# can compute the same verifier again if the password has not changed, or
+# (None, None) if there is no such verifier.
+
+
+def scram_salt_and_rounds(existing_password):
+    if existing_password and existing_password.startswith("SCRAM-SHA-256$"):
+        (_, info, _) = existing_password.split("$", 2)
+        (rounds, b64salt) = info.split(":", 1)
+        return (base64.b64decode(b64salt), int(rounds))
+    return (None, None)
+
+
 # Takes a password_encryption value, a password, and a username (required only
 # if password_encryption == 'md5') and returns a string that is suitable for use
 # as the PASSWORD in CREATE USER commands.
@@ -62,20 +132,12 @@ def encrypted_password(
     if password_encryption == "md5":
         return md5_password(str(password), username)
     elif password_encryption == "scram-sha-256":
-        salt = None
-        rounds = None
-
         if not HAVE_PASSLIB:
             raise AnsibleFilterError(
                 "|encrypted_password requires passlib (did you run `tpaexec setup`?)"
             )
 
-        if existing_password and existing_password.startswith("SCRAM-SHA-256$"):
-            (_, info, _) = existing_password.split("$", 2)
-            (rounds, b64salt) = info.split(":", 1)
-            salt = base64.b64decode(b64salt)
-            rounds = int(rounds)
-
+        (salt, rounds) = scram_salt_and_rounds(existing_password)
         return scram_password(str(password), salt=salt, rounds=rounds)
 
     raise AnsibleFilterError(
@@ -84,8 +146,79 @@ def encrypted_password(
     )
 
 
+# Takes a list of users, each a dict with a password and optionally a username,
+# password_encryption (if not the same as the given default), and
+# existing_password, and returns a list of the corresponding encrypted_password
+# values. Any SCRAM verifiers that are not already cached are computed here,
+# unless `workers` > 1 is given explicitly, in which case they are computed in
+# parallel in a pool of (at most `workers`) forked processes. Forking is safe
+# only when the caller knows that no other threads are running (which is not
+# true of Ansible's worker processes), so it is never the default.
+
+
+def encrypted_passwords(users, password_encryption=None, workers=None):
+    results = [None] * len(users)
+    pending = collections.OrderedDict()
+
+    for i, user in enumerate(users):
+        scheme = user.get("password_encryption", password_encryption)
+        password = user.get("password")
+        existing_password = user.get("existing_password")
+
+        if scheme != "scram-sha-256":
+            results[i] = encrypted_password(
+                scheme, password, user.get("username"), existing_password
+            )
+            continue
+
+        if not HAVE_PASSLIB:
+            raise AnsibleFilterError(
+                "|encrypted_passwords requires passlib (did you run `tpaexec setup`?)"
+            )
+
+        (salt, rounds) = scram_salt_and_rounds(existing_password)
+        if salt is None:
+            # Each new verifier needs its own random salt, so there is nothing
+            # to look up or share; we use the index as a unique key instead.
+            pending[i] = (str(password), salt, rounds, [i])
+            continue
+        key = scram_cache_key(str(password), salt, rounds)
+        results[i] = scram_cache_get(key)
+        if results[i] is None:
+            pending.setdefault(key, (str(password), salt, rounds, []))[3].append(i)
+
+    jobs = list(pending.values())
+    passwords = [job[0] for job in jobs]
+    salts = [job[1] for job in jobs]
+    rounds = [job[2] for job in jobs]
+
+    verifiers = None
+    workers = min(workers or 1, len(jobs))
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        # We can't create a pool in some contexts (e.g., in a daemonic Ansible
+        # worker process), in which case we compute the verifiers here.
+        try:
+            ctx = multiprocessing.get_context("fork")
+            with ctx.Pool(workers) as pool:
+                verifiers = pool.starmap(scram_verifier, zip(passwords, salts, rounds))
+        except (AssertionError, OSError):
+            verifiers = None
+
+    if verifiers is None:
+        verifiers = list(map(scram_verifier, passwords, salts, rounds))
+
+    for key, job, verifier in zip(pending, jobs, verifiers):
+        if job[1] is not None:
+            scram_cache_put(key, verifier)
+        for i in job[3]:
+            results[i] = verifier
+
+    return results
+
+
 class FilterModule(object):
     def filters(self):
         return {
             "encrypted_password": encrypted_password,
+            "encrypted_passwords": encrypted_passwords,
         }
@@ -3,15 +3,26 @@
 # © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
 
 """Tests for the main architecture module."""
+import os
 import shutil
-from unittest.mock import patch
+import threading
+from unittest.mock import MagicMock, patch
 
+import jinja2
 import pytest
 from ansible.template import Templar
 
-from tpaexec.architecture import Architecture
-from tpaexec.architectures import M1, BDR_Always_ON, PGD_Always_ON
-from tpaexec.exceptions import ArchitectureError
+from tpaexec.architecture import Architecture, read_template
+from tpaexec.architectures import (
+    M1,
+    BDR_Always_ON,
+    PGD_Always_ON,
+    configure_many,
+    load_manifest,
+    manifest_argv,
+)
+from tpaexec.architectures.images import Images
+from tpaexec.exceptions import ArchitectureError, ImagesArchitectureError
 from tpaexec.platforms import Platform, PlatformError
 
 
@@ -47,6 +58,15 @@ def cleanup(path):
         pass
 
 
+@pytest.fixture(autouse=True)
+def hostnames_in_order(monkeypatch):
+    """
+    The test architectures' hostnames.txt lists names in the order that these
+    tests expect, so we take them in that order rather than at random.
+    """
+    monkeypatch.setattr("tpaexec.hostnames.random.sample", lambda names, k: names[:k])
+
+
 @pytest.fixture
 def architecture():
     d = BasicArchitecture(
@@ -326,3 +346,170 @@ class TestPGDArchitecture:
         else:
             with pytest.raises(error):
                 pgd_architecture.args["cluster_vars"]["pgd_http_options"]
+
+
+class TestTemplateLoader:
+    def test_loader_is_reused(self, architecture, tmp_path):
+        assert architecture.loader([str(tmp_path)]) is architecture.loader(
+            [str(tmp_path)]
+        )
+        assert architecture.loader() is not architecture.loader([str(tmp_path)])
+
+    def test_expand_template(self, architecture, tmp_path):
+        (tmp_path / "t.j2").write_text("{{ x }}-{{ y|default('none') }}")
+        loader = architecture.loader([str(tmp_path)])
+        assert architecture.expand_template("t.j2", {"x": 1, "y": 2}, loader) == "1-2"
+        assert architecture.expand_template("t.j2", {"x": 3}, loader) == "3-none"
+        assert architecture.expand_template("missing.j2", {}, loader) == "{}"
+
+    def test_compiled_code_is_reused(self, architecture, tmp_path, mocker):
+        (tmp_path / "t.j2").write_text("{{ x }}\n\n")
+        loader = architecture.loader([str(tmp_path)])
+        compile = mocker.spy(jinja2.Environment, "compile")
+        assert architecture.expand_template("t.j2", {"x": 1}, loader) == "1\n\n"
+        assert architecture.expand_template("t.j2", {"x": 2}, loader) == "2\n\n"
+        assert compile.call_count == 1
+
+    def test_template_with_overrides(self, architecture, tmp_path):
+        (tmp_path / "t.j2").write_text(
+            "#jinja2: variable_start_string:'[%', variable_end_string:'%]'\n"
+            "[% x %]-{{ x }}"
+        )
+        (tmp_path / "u.j2").write_text("[% x %]-{{ x }}")
+        loader = architecture.loader([str(tmp_path)])
+        assert architecture.expand_template("u.j2", {"x": 1}, loader) == "[% x %]-1"
+        assert architecture.expand_template("t.j2", {"x": 1}, loader) == "1-{{ x }}"
+        assert architecture.expand_template("u.j2", {"x": 2}, loader) == "[% x %]-2"
+
+    def test_template_is_reread_when_changed(self, tmp_path):
+        path = tmp_path / "t.j2"
+        path.write_text("one")
+        assert read_template(str(path)) == "one"
+        path.write_text("three")
+        assert read_template(str(path)) == "three"
+        assert read_template(str(tmp_path / "missing")) is None
+
+
+class TestManifest:
+    def test_manifest_argv(self):
+        argv = manifest_argv(
+            {
+                "cluster": "c1",
+                "postgresql": 14,
+                "enable_repmgr": True,
+                "no-git": False,
+                "--location-names": ["a", "b"],
+                "layout": None,
+                "args": "--hostnames-from 'my hosts.txt'",
+            },
+            {"architecture": "M1", "postgresql": 13},
+        )
+        assert argv == [
+            "c1",
+            "--architecture",
+            "M1",
+            "--postgresql",
+            "14",
+            "--enable-repmgr",
+            "--location-names",
+            "a",
+            "b",
+            "--hostnames-from",
+            "my hosts.txt",
+        ]
+
+    def test_manifest_argv_no_cluster(self):
+        with pytest.raises(ArchitectureError):
+            manifest_argv({"architecture": "M1"})
+
+    def test_load_manifest(self, tmp_path):
+        yml = tmp_path / "manifest.yml"
+        yml.write_text(
+            "defaults: {architecture: M1}\n"
+            "clusters:\n- cluster: c1\n- {cluster: c2, architecture: PGD-Always-ON}\n"
+        )
+        csv = tmp_path / "manifest.csv"
+        csv.write_text("cluster,architecture,layout\nc1,M1,\nc2,PGD-Always-ON,x\n")
+        assert load_manifest(str(yml)) == [
+            ["c1", "--architecture", "M1"],
+            ["c2", "--architecture", "PGD-Always-ON"],
+        ]
+        assert load_manifest(str(csv)) == [
+            ["c1", "--architecture", "M1"],
+            ["c2", "--architecture", "PGD-Always-ON", "--layout", "x"],
+        ]
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_configure_many(self, tmp_path, workers):
+        manifest = tmp_path / "manifest.yml"
+        manifest.write_text(
+            "- {cluster: %s/c1, architecture: M1}\n"
+            "- {cluster: %s/c2, architecture: M1, platform: nosuch}\n"
+            "- {cluster: %s/c3, architecture: Nosuch}\n" % ((tmp_path,) * 3)
+        )
+        with patch.object(M1, "configure") as configure:
+            results = configure_many(str(manifest), os.getcwd(), workers=workers)
+        assert [c for c, error in results] == [
+            str(tmp_path / c) for c in ["c1", "c2", "c3"]
+        ]
+        assert [error for c, error in results] == [
+            None,
+            "Platform error: Unknown platform: nosuch",
+            "Architecture error: Unknown architecture: Nosuch",
+        ]
+
+    def test_configure_many_without_fork(self, tmp_path):
+        manifest = tmp_path / "manifest.yml"
+        manifest.write_text(
+            "- {cluster: %s/c1, architecture: M1}\n"
+            "- {cluster: %s/c2, architecture: M1}\n" % ((tmp_path,) * 2)
+        )
+        with patch(
+            "multiprocessing.get_all_start_methods", return_value=["spawn"]
+        ), patch("multiprocessing.get_context") as get_context, patch.object(
+            M1, "configure"
+        ):
+            results = configure_many(str(manifest), os.getcwd(), workers=2)
+        get_context.assert_not_called()
+        assert results == [(str(tmp_path / c), None) for c in ["c1", "c2"]]
+
+    def test_duplicate_clusters(self, tmp_path):
+        manifest = tmp_path / "manifest.yml"
+        manifest.write_text("- {cluster: c1}\n- {cluster: c1}\n")
+        with pytest.raises(ArchitectureError, match="Duplicate clusters"):
+            configure_many(str(manifest))
+
+
+class TestImagesArchitecture:
+    def test_lookup_images(self):
+        regions = ["eu-west-1", "eu-west-2", "us-east-1"]
+        distributions = ["Debian", "RedHat"]
+        # Every lookup must be in progress at once for any of them to finish.
+        barrier = threading.Barrier(len(regions) * len(distributions), timeout=10)
+
+        def image(d, lookup, region):
+            barrier.wait()
+            return {"name": f"{d}-{region}"}
+
+        images = Images.__new__(Images)
+        images.platform = MagicMock()
+        images.platform.image.side_effect = image
+        result = images.lookup_images(regions, distributions)
+        assert list(result) == [(r, d) for r in regions for d in distributions]
+        assert result[("us-east-1", "RedHat")] == {"name": "RedHat-us-east-1"}
+
+    def test_lookup_errors(self):
+        def image(d, lookup, region):
+            if d == "Ubuntu" or region == "us-east-1":
+                raise ValueError("no such image")
+            return {"name": d}
+
+        images = Images.__new__(Images)
+        images.platform = MagicMock()
+        images.platform.image.side_effect = image
+        with pytest.raises(ImagesArchitectureError) as e:
+            images.lookup_images(["eu-west-1", "us-east-1"], ["Debian", "Ubuntu"])
+        assert str(e.value) == (
+            "Could not look up 3 image(s): Ubuntu in eu-west-1: no such image; "
+            "Debian in us-east-1: no such image; Ubuntu in us-east-1: no such image"
+        )
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+"""Tests for the AWS platform."""
+
+import json
+import sys
+from unittest.mock import MagicMock, patch
+
+from tpaexec.platforms.aws import AmiCache, aws
+
+IMAGE = {"name": "debian-11-amd64-20230717-1444", "owner": "136693071363"}
+
+
+def platform(tmp_path, **args):
+    arch = MagicMock()
+    arch.args = {
+        "verbosity": 0,
+        "ami_cache": str(tmp_path / "ami-cache.json"),
+        "ami_cache_ttl": 3600,
+        **args,
+    }
+    return aws("aws", arch)
+
+
+class TestAmiCache:
+    def test_memory_only(self):
+        cache = AmiCache()
+        assert cache.get("eu-west-1", "x", "o") is None
+        cache.put("eu-west-1", "x", "o", "ami-1")
+        assert cache.get("eu-west-1", "x", "o") == "ami-1"
+        assert cache.get("eu-west-2", "x", "o") is None
+        assert cache.get("eu-west-1", "x", None) is None
+        cache.save()
+
+    def test_expiry(self, tmp_path):
+        path = str(tmp_path / "cache.json")
+        cache = AmiCache(path, ttl=60)
+        cache.put("eu-west-1", "x", "o", "ami-1")
+        cache.save()
+        assert AmiCache(path, ttl=60).get("eu-west-1", "x", "o") == "ami-1"
+        with patch("tpaexec.platforms.aws.time.time", return_value=2**40):
+            assert AmiCache(path, ttl=60).get("eu-west-1", "x", "o") is None
+        assert AmiCache(path, refresh=True).get("eu-west-1", "x", "o") is None
+
+    def test_concurrent_writers(self, tmp_path):
+        path = str(tmp_path / "cache.json")
+        c1, c2 = AmiCache(path), AmiCache(path)
+        c1.put("eu-west-1", "x", "o", "ami-1")
+        c2.put("eu-west-2", "x", "o", "ami-2")
+        c1.save()
+        c2.save()
+        cache = AmiCache(path)
+        assert cache.get("eu-west-1", "x", "o") == "ami-1"
+        assert cache.get("eu-west-2", "x", "o") == "ami-2"
+
+    def test_invalid_file(self, tmp_path):
+        path = tmp_path / "cache.json"
+        path.write_text("[1, 2")
+        assert AmiCache(str(path)).entries == {}
+        path.write_text(json.dumps({"version": 0, "images": {"k": {}}}))
+        assert AmiCache(str(path)).entries == {}
+
+
+class TestLookupAmi:
+    def test_cache_hit_creates_no_client(self, tmp_path):
+        boto3 = MagicMock()
+        boto3.client.return_value.describe_images.return_value = {
+            "Images": [{"ImageId": "ami-1"}]
+        }
+        with patch.dict(sys.modules, boto3=boto3):
+            p = platform(tmp_path)
+            assert p._lookup_ami(IMAGE, "eu-west-1") == {"image_id": "ami-1"}
+            assert boto3.client.call_count == 1
+
+            p = platform(tmp_path)
+            assert p._lookup_ami(IMAGE, "eu-west-1") == {"image_id": "ami-1"}
+            assert boto3.client.call_count == 1
+
+            p = platform(tmp_path, refresh_ami_cache=True)
+            assert p._lookup_ami(IMAGE, "eu-west-1") == {"image_id": "ami-1"}
+            assert boto3.client.call_count == 2
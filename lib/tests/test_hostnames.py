@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+"""Tests for hostname selection."""
+
+import pytest
+
+from tpaexec.exceptions import ArchitectureError
+from tpaexec.hostnames import select_hostnames, sort_names
+
+NAMES = """zeta 192.0.2.1
+Alpha
+beta-2  192.0.2.2
+gamma_bad
+delta
+
+epsilon
+"""
+
+
+@pytest.fixture
+def names(tmp_path):
+    path = tmp_path / "names.txt"
+    path.write_text(NAMES)
+    return str(path)
+
+
+@pytest.fixture
+def default_names(tmp_path):
+    path = tmp_path / "hostnames.txt"
+    path.write_text("".join("name%d\n" % i for i in range(5000)))
+    return str(path)
+
+
+def test_names_from_file_in_order(names, default_names):
+    assert select_hostnames(4, names_from=names, default_names=default_names) == (
+        ["zeta", "Alpha", "beta-2", "delta"],
+        ["192.0.2.1", None, "192.0.2.2", None],
+    )
+
+
+def test_random_by_default(default_names):
+    hostnames, addresses = select_hostnames(3000, default_names=default_names)
+    assert len(set(hostnames)) == 3000
+    assert addresses == [None] * 3000
+    assert hostnames != ["name%d" % i for i in range(3000)]
+
+
+def test_unsorted(default_names):
+    hostnames, _ = select_hostnames(3, unsorted=True, default_names=default_names)
+    assert hostnames == ["name0", "name1", "name2"]
+
+
+def test_sorted_by(default_names):
+    hostnames, _ = select_hostnames(2, sorted_by="-d", default_names=default_names)
+    assert hostnames == ["name0", "name1"]
+
+
+def test_pattern(names):
+    hostnames, _ = select_hostnames(2, names_from=names, pattern="[[:lower:]]+")
+    assert hostnames == ["delta", "epsilon"]
+
+
+def test_not_enough_names(names):
+    with pytest.raises(ArchitectureError, match="found only 2/3 names matching"):
+        select_hostnames(3, names_from=names, pattern="[a-z]+")
+
+
+def test_not_enough_default_names(default_names):
+    with pytest.raises(ArchitectureError, match="found only 5000/5001 names"):
+        select_hostnames(5001, default_names=default_names)
+    with pytest.raises(ArchitectureError, match="found only 5000/5001 names"):
+        select_hostnames(5001, sorted_by="-d", default_names=default_names)
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(ArchitectureError, match="could not open hostname list"):
+        select_hostnames(1, names_from=str(tmp_path / "missing"))
+
+
+def test_file_is_reread_when_changed(names):
+    assert select_hostnames(1, names_from=names)[0] == ["zeta"]
+    with open(names, "w") as f:
+        f.write("eta\n")
+    assert select_hostnames(1, names_from=names)[0] == ["eta"]
+
+
+@pytest.mark.parametrize(
+    "sorted_by, expected",
+    [
+        ("--dictionary-order", ["B", "ab", "a.c"]),
+        ("-d", ["B", "ab", "a.c"]),
+    ],
+)
+def test_sort_names(sorted_by, expected):
+    assert sort_names(["ab", "B", "a.c"], sorted_by) == expected
+
+
+def test_random_sort():
+    names = ["name%d" % i for i in range(100)]
+    assert sorted(sort_names(names, "-R")) == sorted(names)
+
+
+def test_unsupported_sort_option():
+    with pytest.raises(
+        ArchitectureError, match=r"unsupported .*: -k \(supported: -d -R"
+    ):
+        sort_names(["a"], "-k")
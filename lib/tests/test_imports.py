@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+"""
+Tests that tpaexec defers its slowest imports until they are needed.
+
+Run this file directly to measure how long each of the startup paths below
+takes (the median of several runs, each in a new interpreter).
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Modules that take a long time to import, and which tpaexec should load only
+# when it actually needs them.
+SLOW_MODULES = ["ansible.template", "ansible.utils.vars", "boto3"]
+
+STARTUP_PATHS = {
+    "import tpaexec": "import tpaexec",
+    "import aws platform": "import tpaexec.platforms.aws",
+    "configure --help": (
+        "import contextlib, io, tpaexec\n"
+        "with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()):\n"
+        "    tpaexec.configure(['x', '--architecture', 'M1', '--platform', 'aws', '--help'])"
+    ),
+}
+
+
+def run_python(code):
+    env = dict(os.environ, TPA_DIR=os.getcwd(), PYTHONPATH="lib")
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+
+
+@pytest.mark.parametrize("path", STARTUP_PATHS)
+def test_slow_modules_not_imported(path):
+    code = STARTUP_PATHS[path] + "\nimport sys\nprint(' '.join(sys.modules))\n"
+    modules = run_python(code).split()
+    assert [m for m in SLOW_MODULES if m in modules] == []
+
+
+def benchmark(runs=5):
+    for path, code in STARTUP_PATHS.items():
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            run_python(code)
+            times.append(time.perf_counter() - start)
+        print("%-24s %6.1f ms" % (path, statistics.median(times) * 1000))
+
+
+if __name__ == "__main__":
+    benchmark()
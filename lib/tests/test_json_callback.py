@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+import json
+import os
+from unittest.mock import MagicMock
+
+import pytest
+from ansible.plugins.loader import callback_loader
+
+callback_loader.add_directory(
+    os.path.join(os.path.dirname(__file__), "..", "callback_plugins")
+)
+
+
+class FakeHost:
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class FakeTask:
+    def __init__(self, name, uuid, action="command", role=None):
+        self.name = name
+        self._uuid = uuid
+        self.action = action
+        self._role = role
+
+    def get_name(self):
+        return self.name
+
+
+class FakeResult:
+    def __init__(self, host, task, result):
+        self._host = host
+        self._task = task
+        self._result = result
+
+
+@pytest.fixture
+def play():
+    play = MagicMock()
+    play.strategy = "linear"
+    play.get_name.return_value = "deploy"
+    play._uuid = "p1"
+    return play
+
+
+@pytest.fixture
+def stats():
+    stats = MagicMock()
+    stats.processed = {"a": 1, "b": 1}
+    stats.summarize.side_effect = lambda h: {"ok": 1, "failures": 0}
+    stats.custom = {}
+    return stats
+
+
+def callback(**options):
+    display = MagicMock(verbosity=0)
+    cb = callback_loader.get("json", display=display)
+    cb.set_options(direct=options)
+    return cb, display
+
+
+def output(display):
+    return [call.args[0] for call in display.display.call_args_list]
+
+
+def run(cb, play, stats, results):
+    cb.v2_playbook_on_play_start(play)
+    task = FakeTask("t1", "t1")
+    cb.v2_playbook_on_task_start(task, False)
+    for host, result in results.items():
+        cb.v2_runner_on_ok(FakeResult(FakeHost(host), task, result))
+    cb.v2_playbook_on_stats(stats)
+
+
+def test_json_document(play, stats):
+    cb, display = callback()
+    run(cb, play, stats, {"a": {"changed": True}, "b": {"changed": False}})
+
+    (text,) = output(display)
+    doc = json.loads(text)
+    assert doc["stats"]["a"] == {"ok": 1, "failures": 0}
+    hosts = doc["plays"][0]["tasks"][0]["hosts"]
+    assert hosts["a"] == {"changed": True, "action": "command"}
+
+
+def test_json_lines(play, stats):
+    cb, display = callback(json_lines=True)
+    run(cb, play, stats, {"a": {"changed": True}, "b": {"changed": False}})
+
+    lines = output(display)
+    assert all("\n" not in line for line in lines)
+    events = [json.loads(line) for line in lines]
+    assert [e["event"] for e in events] == [
+        "play_start",
+        "task_result",
+        "task_result",
+        "stats",
+    ]
+    assert events[1]["host"] == "a"
+    assert events[1]["task"]["name"] == "t1"
+    assert events[1]["result"] == {"changed": True, "action": "command"}
+    assert "plays" not in events[-1]
+    assert cb.results[0]["tasks"][0]["hosts"] == {}
+
+
+def test_profile(play, stats, mocker):
+    cb, display = callback(profile=True, profile_top=1)
+    clock = mocker.patch("time.monotonic")
+
+    role = MagicMock()
+    role.get_name.return_value = "postgres"
+    t1 = FakeTask("t1", "t1", role=role)
+    t2 = FakeTask("t2", "t2")
+    a, b = FakeHost("a"), FakeHost("b")
+
+    cb.v2_playbook_on_play_start(play)
+    for task, ends in [(t1, {"a": 3.0, "b": 1.0}), (t2, {"b": 4.5, "a": 5.0})]:
+        start = ends["a"] - 3.0 if task is t2 else 0.0
+        clock.return_value = start
+        cb.v2_playbook_on_task_start(task, False)
+        for host in (a, b):
+            cb.v2_runner_on_start(host, task)
+        for host in sorted(ends, key=ends.get):
+            clock.return_value = ends[host]
+            cb.v2_runner_on_ok(FakeResult(FakeHost(host), task, {}))
+    cb.v2_playbook_on_stats(stats)
+
+    profile = json.loads(output(display)[0])["profile"]
+    assert profile["tasks"] == [
+        {
+            "name": "t1",
+            "id": "t1",
+            "play": "deploy",
+            "role": "postgres",
+            "duration": 3.0,
+            "hosts": 2,
+        }
+    ]
+    assert profile["roles"] == {
+        "a": {"postgres": 3.0, "(none)": 3.0},
+        "b": {"postgres": 1.0, "(none)": 2.5},
+    }
+    assert profile["stragglers"] == [
+        {
+            "name": "t1",
+            "id": "t1",
+            "play": "deploy",
+            "host": "a",
+            "duration": 3.0,
+            "idle": 2.0,
+        }
+    ]
+    assert profile["lockstep_idle"] == {"hosts": {"a": 0.0, "b": 2.5}, "total": 2.5}
+
+
+def test_result_rules(play, stats):
+    rules = {
+        "cluster_discovery": {"keep": ["changed", "msg"]},
+        "postgresql_query": {"drop": ["results"]},
+        "*": {"max_string": 4},
+    }
+    cb, display = callback(result_rules=json.dumps(rules))
+
+    cb.v2_playbook_on_play_start(play)
+    for i, (action, result) in enumerate(
+        [
+            ("cluster_discovery", {"changed": False, "cluster_facts": {"x": 1}}),
+            ("postgresql_query", {"results": [{"a": 1}], "rowcount": 1}),
+            ("ansible.builtin.command", {"stdout": "hé€llo", "lines": ["abcdef"]}),
+        ]
+    ):
+        task = FakeTask("t%d" % i, "t%d" % i, action=action)
+        cb.v2_playbook_on_task_start(task, False)
+        cb.v2_runner_on_ok(FakeResult(FakeHost("a"), task, result))
+    cb.v2_playbook_on_stats(stats)
+
+    tasks = json.loads(output(display)[0])["plays"][0]["tasks"]
+    results = [t["hosts"]["a"] for t in tasks]
+    assert results[0] == {"changed": False, "action": "cluster_discovery"}
+    assert results[1] == {"rowcount": 1, "action": "postgresql_query"}
+    assert results[2] == {
+        "stdout": "hé... (6 bytes truncated)",
+        "lines": ["abcd... (2 bytes truncated)"],
+        "action": "ansible.builtin.command",
+    }
+
+
+def test_host_budget(play, stats):
+    cb, display = callback(host_budget=50)
+
+    cb.v2_playbook_on_play_start(play)
+    for i in range(3):
+        task = FakeTask("t%d" % i, "t%d" % i)
+        cb.v2_playbook_on_task_start(task, False)
+        result = {"changed": True, "rc": 0, "stdout": "x" * 40}
+        cb.v2_runner_on_ok(FakeResult(FakeHost("a"), task, result))
+        cb.v2_runner_on_ok(FakeResult(FakeHost("b"), task, {"rc": 0}))
+    cb.v2_playbook_on_stats(stats)
+
+    tasks = json.loads(output(display)[0])["plays"][0]["tasks"]
+    assert "stdout" in tasks[0]["hosts"]["a"]
+    assert tasks[2]["hosts"]["a"] == {
+        "changed": True,
+        "rc": 0,
+        "budget_exceeded": True,
+        "action": "command",
+    }
+    assert tasks[2]["hosts"]["b"] == {"rc": 0, "action": "command"}
+
+
+def test_invalid_result_rules(play, stats):
+    cb, display = callback(result_rules='{"command": ["changed"]}')
+    display.warning.assert_called_once()
+    run(cb, play, stats, {"a": {"changed": True}})
+    assert json.loads(output(display)[0])["plays"][0]["tasks"][0]["hosts"]["a"]
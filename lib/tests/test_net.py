@@ -7,9 +7,9 @@ from ipaddress import IPv4Network
 
 import pytest
 
-from tpaexec.net import Network, Subnets
+from tpaexec.net import Network, SubnetRegistry, Subnets
 from tpaexec.architecture import Architecture
-from tpaexec.exceptions import NetError
+from tpaexec.exceptions import ArchitectureError, NetError
 
 
 @pytest.fixture()
@@ -74,6 +74,52 @@ class TestSubnets:
     def test_subnets_get(self, subnets):
         assert subnets[0] == IPv4Network("10.0.0.0/28")
 
+    def test_subnets_exclude_partial_overlap(self, subnets):
+        subnets.exclude(
+            ["10.0.0.20/30", "10.0.0.0/27", "192.168.0.0/16", "10.0.0.64/26"]
+        )
+        assert subnets.free == [(2, 4), (8, 16)]
+        assert [str(s) for s in subnets.slice(3)] == [
+            "10.0.0.32/28",
+            "10.0.0.48/28",
+            "10.0.0.128/28",
+        ]
+
+    def test_subnets_large_network(self):
+        subnets = Subnets(cidr="10.0.0.0/8", limit=3)
+        subnets.exclude(["10.0.0.0/9", "10.128.0.0/10"])
+        assert subnets.free == [(786432, 1048576)]
+        assert [str(s) for s in subnets] == [
+            "10.192.0.0/28",
+            "10.192.0.16/28",
+            "10.192.0.32/28",
+        ]
+
+        subnets.shuffle()
+        picked = subnets.slice()
+        assert picked == subnets.slice()
+        assert len(set(picked)) == 3
+        assert all(s.subnet_of(IPv4Network("10.192.0.0/10")) for s in picked)
+        assert subnets._ranges is None
+
+    def test_subnets_shuffle_most(self, subnets):
+        subnets.exclude(["10.0.0.0/25"])
+        subnets.shuffle()
+        picked = subnets.slice(6)
+        assert sorted(picked) == sorted(subnets.ranges[:6])
+        assert len(set(picked)) == 6
+        assert len(subnets.ranges) == 8
+
+    def test_subnets_shuffle_few_then_most(self, subnets):
+        subnets.exclude(["10.0.0.0/25"])
+        subnets.shuffle()
+        few = subnets.slice(2)
+        assert subnets._ranges is None
+        most = subnets.slice(6)
+        assert most[:2] == few
+        assert len(set(most)) == 6
+        assert all(isinstance(s, IPv4Network) for s in most)
+
 
 class TestArchitectureSubnet:
     def test_exclusion_files(self):
@@ -89,3 +135,50 @@ class TestArchitectureSubnet:
             "10.33.237.96/28",
             "10.33.74.160/28",
         ]
+
+    def test_missing_config(self, tmp_path):
+        with pytest.raises(ArchitectureError, match="provided path: %s" % tmp_path):
+            Architecture._get_subnets_from(exclude_dirs=[str(tmp_path)])
+
+
+class TestSubnetRegistry:
+    def config(self, path, subnet):
+        path.mkdir(exist_ok=True)
+        (path / "config.yml").write_text(
+            "locations:\n- Name: main\n  subnet: %s\ninstances: []\n" % subnet
+        )
+
+    def test_registry(self, tmp_path, mocker):
+        registry = str(tmp_path / "cache" / "subnets.json")
+        a, b = tmp_path / "a", tmp_path / "b"
+        self.config(a, "10.33.1.0/28")
+        self.config(b, "10.33.2.0/28")
+
+        subnets = Architecture._get_subnets_from([str(a), str(b)], registry=registry)
+        assert sorted(subnets) == ["10.33.1.0/28", "10.33.2.0/28"]
+
+        # Unchanged files are not parsed again, only the one that has changed.
+        parse = mocker.spy(SubnetRegistry, "_parse")
+        self.config(b, "10.33.3.0/28")
+        os.utime(b / "config.yml", ns=(0, 0))
+        subnets = Architecture._get_subnets_from([str(a), str(b)], registry=registry)
+        assert sorted(subnets) == ["10.33.1.0/28", "10.33.3.0/28"]
+        parse.assert_called_once_with([os.path.join(str(b), "config.yml")])
+
+        r = SubnetRegistry(registry)
+        assert r.lookup([str(a)]) == {str(a): ["10.33.1.0/28"]}
+        assert not r.changed
+
+    def test_invalid_registry(self, tmp_path):
+        registry = tmp_path / "subnets.json"
+        registry.write_text("[1, 2")
+        assert SubnetRegistry(str(registry)).entries == {}
+
+    def test_parse_in_parallel(self, tmp_path, mocker):
+        mocker.patch("os.cpu_count", return_value=4)
+        dirs = []
+        for i in range(8):
+            self.config(tmp_path / str(i), "10.33.%d.0/28" % i)
+            dirs.append(str(tmp_path / str(i)))
+        found = SubnetRegistry().lookup(dirs)
+        assert [found[d] for d in dirs] == [["10.33.%d.0/28" % i] for i in range(8)]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+import base64
+
+from ..filter_plugins import passwords
+from ..filter_plugins.passwords import (
+    encrypted_password,
+    scram_password,
+)
+
+EXISTING = "SCRAM-SHA-256$4096:c2FsdHNhbHRzYWx0$x:y"
+
+
+def test_scram_password():
+    """
+    Test that scram_password computes the same verifier as PostgreSQL for a
+    known salt and iteration count.
+    """
+    assert scram_password("secret", salt=b"saltsaltsalt", rounds=4096) == (
+        "SCRAM-SHA-256$4096:c2FsdHNhbHRzYWx0"
+        "$UdmKRUjfgm0U6mfMFFn/tGaEoriNY2YlrUES5w+4kaA="
+        ":ZH6upP+u0RFc4kNZYflxg+txwr3oIlzDM/JXePM5XCY="
+    )
+
+
+def test_encrypted_password_existing_salt():
+    """
+    Test that encrypted_password reuses the salt and iteration count from an
+    existing verifier.
+    """
+    v = encrypted_password("scram-sha-256", "secret", existing_password=EXISTING)
+    assert v == scram_password("secret", salt=b"saltsaltsalt", rounds=4096)
+
+
+def test_scram_password_cache(mocker):
+    """
+    Test that verifiers with an explicit salt are remembered (but not under
+    the password itself), and that the least recently used ones are forgotten.
+    """
+    mocker.patch.object(passwords, "SCRAM_CACHE_SIZE", 2)
+    mocker.patch.object(passwords, "scram_cache", passwords.scram_cache.__class__())
+    derive = mocker.spy(passwords, "scram_verifier")
+    salt = b"saltsaltsalt"
+
+    v1 = scram_password("one", salt=salt, rounds=4096)
+    assert scram_password("one", salt=salt, rounds=4096) == v1
+    assert derive.call_count == 1
+    assert all(b"one" not in key for key in passwords.scram_cache)
+
+    scram_password("two", salt=salt, rounds=4096)
+    scram_password("three", salt=salt, rounds=4096)
+    assert derive.call_count == 3
+    assert len(passwords.scram_cache) == 2
+
+    assert scram_password("one", salt=salt, rounds=4096) == v1
+    assert derive.call_count == 4
+
+
+def test_scram_password_new_salt(mocker):
+    """
+    Test that a new salt is generated (and nothing is cached) every time no
+    salt is given, so that the same password never yields the same verifier.
+    """
+    mocker.patch.object(passwords, "scram_cache", passwords.scram_cache.__class__())
+    v1 = scram_password("one", rounds=4096)
+    v2 = scram_password("one", rounds=4096)
+    assert v1 != v2
+    assert len(base64.b64decode(v1.split("$")[1].split(":")[1])) == 12
+    assert len(passwords.scram_cache) == 0
+
+
+def test_encrypted_passwords(mocker):
+    """
+    Test that encrypted_passwords returns the same verifiers as
+    encrypted_password for each user, in order, and computes each distinct
+    SCRAM verifier only once.
+    """
+    mocker.patch.object(passwords, "scram_cache", passwords.scram_cache.__class__())
+    users = [
+        {"username": "a", "password": "one", "existing_password": EXISTING},
+        {"username": "b", "password": "two", "password_encryption": "md5"},
+        {"username": "c", "password": "three", "existing_password": EXISTING},
+        {"username": "d", "password": "one", "existing_password": EXISTING},
+    ]
+
+    verifiers = passwords.encrypted_passwords(users, "scram-sha-256", workers=2)
+    assert verifiers == [
+        encrypted_password(
+            u.get("password_encryption", "scram-sha-256"),
+            u["password"],
+            u["username"],
+            existing_password=u.get("existing_password"),
+        )
+        for u in users
+    ]
+    assert verifiers[0] == verifiers[3]
+    assert len(passwords.scram_cache) == 2
+
+    derive = mocker.spy(passwords, "scram_verifier")
+    assert passwords.encrypted_passwords(users, "scram-sha-256") == verifiers
+    assert derive.call_count == 0
+
+
+def test_encrypted_passwords_new_salts():
+    """
+    Test that users with the same password and no existing verifier get
+    different verifiers.
+    """
+    users = [{"username": u, "password": "same"} for u in ("a", "b")]
+    v = passwords.encrypted_passwords(users, "scram-sha-256")
+    assert v[0] != v[1]
+    assert all(x.startswith("SCRAM-SHA-256$") for x in v)
+
+
+def test_encrypted_passwords_serial_by_default(mocker):
+    """
+    Test that encrypted_passwords does not fork a pool of processes unless
+    it is explicitly asked to.
+    """
+    mocker.patch.object(passwords, "scram_cache", passwords.scram_cache.__class__())
+    get_context = mocker.spy(passwords.multiprocessing, "get_context")
+    users = [
+        {"username": "a", "password": "one", "existing_password": EXISTING},
+        {"username": "b", "password": "two", "existing_password": EXISTING},
+        {"username": "c", "password": "three"},
+    ]
+    verifiers = passwords.encrypted_passwords(users, "scram-sha-256")
+    get_context.assert_not_called()
+    assert verifiers[:2] == [
+        scram_password("one", salt=b"saltsaltsalt", rounds=4096),
+        scram_password("two", salt=b"saltsaltsalt", rounds=4096),
+    ]
+    assert verifiers[2].startswith("SCRAM-SHA-256$")
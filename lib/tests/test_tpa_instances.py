@@ -306,3 +306,82 @@ class TestInstances:
             [Instance("a", cluster=basic_cluster, location_name="known")]
         )
         assert instances.maybe().name == "a"
+
+
+class TestInstancesIndexes:
+    """test that Instances indexes are kept up to date"""
+
+    def test_instance_changes(self, basic_cluster, instances_with_roles):
+        """changes made to instances in any way are seen by collections"""
+        a = instances_with_roles.with_name("a").only()
+        b = instances_with_roles.with_name("b").only()
+        assert instances_with_roles.with_role("barman").get_names() == ["b"]
+        assert instances_with_roles.with_bdr_node_kind("data").get_names() == ["b"]
+        assert instances_with_roles.with_hostvar("x").get_names() == []
+
+        a.settings["role"].append("barman")
+        b.host_vars["x"] = 1
+        basic_cluster.instance_defaults["role"] = ["postgres"]
+        del b.settings["role"]
+        assert instances_with_roles.with_role("barman").get_names() == ["a"]
+        assert instances_with_roles.with_role("postgres").get_names() == ["b"]
+        assert instances_with_roles.with_bdr_node_kind("data").get_names() == []
+        assert instances_with_roles.with_hostvar("x", value=1).get_names() == ["b"]
+
+    def test_indexes_are_reused(self, instances_with_roles, mocker):
+        """role and hostvar indexes are rebuilt only after a change"""
+        roles = mocker.spy(Instance, "get_setting")
+        instances_with_roles.with_role("bdr")
+        instances_with_roles.without_roles(["barman", "witness"])
+        assert roles.call_count == 2
+
+        instances_with_roles.set_hostvar("x", 1)
+        assert instances_with_roles.with_role("bdr").get_names() == ["a", "b"]
+        assert roles.call_count == 4
+
+    def test_location_settings(self, basic_cluster, instances_with_roles):
+        """roles inherited from a location's settings are indexed too"""
+        basic_cluster.get_location_by_name("known").settings.setdefault(
+            "role", []
+        ).append("postgres")
+        assert instances_with_roles.with_role("postgres").get_names() == []
+        del instances_with_roles[0].settings["role"]
+        assert instances_with_roles.with_role("postgres").get_names() == ["a"]
+
+    def test_yaml(self, basic_cluster, instances_with_roles):
+        """tracked settings are written out as plain YAML"""
+        instances_with_roles.set_hostvar("x", 1)
+        assert "!!python" not in basic_cluster.to_yaml()
+        assert instances_with_roles[0].to_yaml_dict()["role"] == ["bdr", "witness"]
+
+    def test_collection_changes(self, basic_cluster, instances_with_roles):
+        """changes to the collection itself are seen by later selections"""
+        assert instances_with_roles.in_location("known").get_names() == ["a", "b"]
+        instances_with_roles.reverse()
+        assert instances_with_roles.in_location("known").get_names() == ["b", "a"]
+        instances_with_roles.pop()
+        assert instances_with_roles.in_location("known").get_names() == ["b"]
+        instances_with_roles.append(
+            Instance("c", cluster=basic_cluster, location_name="known")
+        )
+        assert instances_with_roles.with_name("c").get_names() == ["c"]
+        assert instances_with_roles.without_role("bdr").get_names() == ["c"]
+
+    def test_cluster_instances(self, basic_cluster, basic_instances):
+        """cluster.instances returns a new collection each time"""
+        instances = basic_cluster.instances
+        assert instances.with_name("a").get_names() == ["a"]
+        instances.pop()
+        instances.append(Instance("x", cluster=basic_cluster, location_name="known"))
+        assert instances.with_name("x").get_names() == ["x"]
+        assert basic_cluster.instances is not instances
+        assert basic_cluster.instances.get_names() == ["a", "b"]
+        assert basic_cluster.instances.with_name("x").get_names() == []
+
+        basic_cluster.add_instance("c", location_name="known")
+        assert basic_cluster.instances.get_names() == ["a", "b", "c"]
+        assert basic_cluster.instances.in_location("known").get_names() == [
+            "a",
+            "b",
+            "c",
+        ]
@@ -11,6 +11,7 @@ from .group import Group
 from .location import Location
 from .instance import Instance
 from .instances import Instances
+from .settings import Settings
 
 
 class Cluster:
@@ -37,7 +38,8 @@ class Cluster:
         self._group = Group(cluster_name, group_vars=group_vars)
         self._locations: List[Location] = []
         self._instances: List[Instance] = []
-        self._instance_defaults = {}
+        self._instance_indexes: Dict[str, Any] = {}
+        self._instance_defaults = Settings()
         self._settings = {}
 
     @property
@@ -78,8 +80,14 @@ class Cluster:
 
     @property
     def instances(self):
-        """A list of instances in this cluster"""
-        return Instances(self._instances)
+        """A list of instances in this cluster
+
+        Each call returns a new collection, but they all share the indexes
+        built by selecting instances by name or location, until another
+        instance is added (or the collection itself is changed)."""
+        instances = Instances(self._instances)
+        instances._indexes = self._instance_indexes
+        return instances
 
     @property
     def instance_defaults(self):
@@ -113,6 +121,7 @@ class Cluster:
         if instance_name not in self.instances.get_names():
             i = Instance(instance_name, cluster=self, **kwargs)
             self._instances.append(i)
+            self._instance_indexes = {}
             return i
         else:
             raise ClusterError(
@@ -185,7 +194,7 @@ class Cluster:
                 loc.pop("Name"), group_vars=loc.pop("vars", {}), settings=loc
             )
 
-        c._instance_defaults = y.pop("instance_defaults", {})
+        c._instance_defaults = Settings(y.pop("instance_defaults", {}))
 
         instances = y.pop("instances", [])
         for i in instances:
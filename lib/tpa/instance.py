@@ -6,6 +6,7 @@ from typing import Any
 from collections import ChainMap
 
 from .exceptions import InstanceError
+from .settings import Settings
 
 
 class Instance:
@@ -25,8 +26,8 @@ class Instance:
             self._location = cluster.get_location_by_name(location_name)
         else:
             raise InstanceError(f"Could not find location '{location_name}'.")
-        self._settings = settings or {}
-        self._host_vars = host_vars or {}
+        self._settings = Settings(settings or {})
+        self._host_vars = Settings(host_vars or {})
 
     def __repr__(self):
         return f"Instance({self.name!r})"
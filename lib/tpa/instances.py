@@ -3,19 +3,62 @@
 # © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
 
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from tpa.exceptions import ConfigureError
 from tpa.instance import Instance
+from tpa.settings import Settings
+
+
+# For each kind of index, how to find the keys under which it holds an
+# instance, and how to tell which version of the instances it reflects.
+# Names and locations cannot change after an instance is created, but roles
+# and host_vars can, so we rebuild those indexes after any Settings change.
+INDEXES = {
+    "name": (lambda i: [i.name], lambda: 0),
+    "location": (lambda i: [i.location.name], lambda: 0),
+    "role": (lambda i: dict.fromkeys(i.roles), lambda: Settings.changes),
+    "hostvar": (lambda i: list(i.host_vars), lambda: Settings.changes),
+}
 
 
 class Instances(list):
     """Represents a collection of instances, and provides methods to operate on
-    all or a selected subset of those instances."""
+    all or a selected subset of those instances.
+
+    Instances are indexed by name, location, role, and hostvar (the first
+    time each is needed), so that selecting them does not require looking at
+    every instance. The indexes are discarded if the collection is changed,
+    and those by role and hostvar are rebuilt after any change to settings,
+    host_vars, or instance_defaults."""
+
+    _indexes = None
 
     def __init__(self, *args):
         super().__init__(*args)
 
+    def _index(self, kind: str) -> Dict[Any, List[Instance]]:
+        """Returns a dict mapping each key of the given kind to a list of the
+        instances in this collection that have it, in order."""
+        keys, version = INDEXES[kind]
+        if self._indexes is None:
+            self._indexes = {}
+        built = self._indexes.get(kind)
+        if built is None or built[0] != version():
+            index = {}
+            for i in self:
+                for k in keys(i):
+                    index.setdefault(k, []).append(i)
+            built = self._indexes[kind] = (version(), index)
+        return built[1]
+
+    def _lookup(self, kind: str, key) -> List[Instance]:
+        try:
+            return self._index(kind).get(key, [])
+        except TypeError:
+            # An unhashable key can't be in the index.
+            return []
+
     def select(self, callback):
         """Returns a new collection of instances for which the given callback
         returns true."""
@@ -26,29 +69,33 @@ class Instances(list):
         .only() to retrieve the instance itself, or .maybe() if you're not sure
         that there is one.
         """
-        return Instances([i for i in self if i.name == name])
+        return Instances(self._lookup("name", name))
 
     def with_role(self, role: str):
         """Returns a new collection of instances that have the given role."""
-        return Instances([i for i in self if role in i.roles])
+        return Instances(self._lookup("role", role))
 
     def with_roles(self, roles: List[str]):
         """Returns a new collection of instances that have all of the given
         list of role names."""
-        return Instances([i for i in self if set(roles).issubset(i.roles)])
+        if not roles:
+            return Instances(self)
+        candidates = min((self._lookup("role", r) for r in roles), key=len)
+        return Instances([i for i in candidates if set(roles).issubset(i.roles)])
 
     def without_role(self, role: str):
         """Returns a new collection of instances that don't have the given role."""
-        return Instances([i for i in self if role not in i.roles])
+        return self.without_roles([role])
 
     def without_roles(self, roles: List[str]):
         """Returns a new collection of instances that have none of the given
         list of role names."""
-        return Instances([i for i in self if set(roles).isdisjoint(i.roles)])
+        excluded = set(id(i) for r in roles for i in self._lookup("role", r))
+        return Instances([i for i in self if id(i) not in excluded])
 
     def in_location(self, location_name):
         """Returns a new collection of instances in the given location."""
-        return Instances([i for i in self if i.location.name == location_name])
+        return Instances(self._lookup("location", location_name))
 
     def with_hostvar(self, key, **kwargs):
         """Returns a new collection of instances that have the given key set
@@ -59,8 +106,8 @@ class Instances(list):
         return Instances(
             [
                 i
-                for i in self
-                if key in i.host_vars and (val is None or i.host_vars.get(key) == val)
+                for i in self._lookup("hostvar", key)
+                if val is None or i.host_vars.get(key) == val
             ]
         )
 
@@ -129,3 +176,33 @@ class Instances(list):
         elif num == 1:
             return self[0]
         return None
+
+
+def _invalidates_indexes(method):
+    """Wraps a list method that changes the list so that it also discards any
+    indexes built for the collection."""
+
+    def wrapper(self, *args, **kwargs):
+        self._indexes = None
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _method in [
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "clear",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "reverse",
+    "sort",
+]:
+    setattr(Instances, _method, _invalidates_indexes(getattr(list, _method)))
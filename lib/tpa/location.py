@@ -3,6 +3,7 @@
 # © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
 
 from .group import Group
+from .settings import Settings
 import re
 
 
@@ -25,7 +26,7 @@ class Location:
     ):
         self._name: str = location_name
         self._group: Group = Group(f"location_{location_name}", group_vars=group_vars)
-        self._settings = settings or {}
+        self._settings = Settings(settings or {})
         self._witness_only = witness_only
 
     def __repr__(self):
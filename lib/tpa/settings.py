@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+import yaml
+
+
+class Settings(dict):
+    """A dict of settings (or host_vars) that counts the changes made to it,
+    and to any list of roles in it, so that collections of instances can tell
+    when their indexes by role or hostvar are stale.
+
+    Changes made inside any other value (e.g., a nested dict) are not counted,
+    because no index depends on them."""
+
+    # The number of changes made to any Settings or Roles so far.
+    changes = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key == "role" and isinstance(value, list) and not isinstance(value, Roles):
+            value = Roles(value)
+        Settings.changes += 1
+        super().__setitem__(key, value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+
+class Roles(list):
+    """A list of roles that counts the changes made to it as changes to the
+    Settings that contain it."""
+
+
+def _counts_changes(cls, method):
+    """Wraps a dict or list method that changes the container so that it also
+    counts the change."""
+
+    def wrapper(self, *args, **kwargs):
+        Settings.changes += 1
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    setattr(cls, method.__name__, wrapper)
+
+
+for _method in ["__delitem__", "clear", "pop", "popitem"]:
+    _counts_changes(Settings, getattr(dict, _method))
+
+for _method in [
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "clear",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "reverse",
+    "sort",
+]:
+    _counts_changes(Roles, getattr(list, _method))
+
+# We write these out in config.yml just as we would a plain dict or list.
+yaml.SafeDumper.add_representer(Settings, yaml.SafeDumper.represent_dict)
+yaml.SafeDumper.add_representer(Roles, yaml.SafeDumper.represent_list)
@@ -14,14 +14,29 @@ import re
 
 from typing import List
 
-from ansible.template import Templar
-from ansible.utils.vars import merge_hash
 from functools import reduce
 
 from .exceptions import ArchitectureError, ExternalCommandError
-from .net import Network, DEFAULT_SUBNET_PREFIX_LENGTH, DEFAULT_NETWORK_CIDR
+from .hostnames import select_hostnames
+from .net import (
+    Network,
+    SubnetRegistry,
+    DEFAULT_SUBNET_PREFIX_LENGTH,
+    DEFAULT_NETWORK_CIDR,
+)
 from .platforms import Platform
 
+# The C implementation of the YAML parser is much faster, if it is available.
+YamlLoader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+# The contents of each template file we have read, keyed by (path, mtime,
+# size), so that we read each template only once per process.
+template_cache = {}
+
+# The TemplateLoader for each list of template directories, shared by every
+# Architecture in this process (e.g., when configuring clusters in bulk).
+template_loaders = {}
+
 
 class Architecture(object):
     """
@@ -371,6 +386,11 @@ class Architecture(object):
             default=[],
         )
         g.add_argument("--no-shuffle-subnets", action="store_true")
+        g.add_argument(
+            "--subnet-registry",
+            metavar="FILE",
+            help="file in which to remember the subnets found with --exclude-subnets-from",
+        )
         g.add_argument(
             "--subnet-prefix",
             default=DEFAULT_SUBNET_PREFIX_LENGTH,
@@ -579,6 +599,11 @@ class Architecture(object):
         # anything to restrict which keys this can be applied to, so it's quite
         # possible to misuse this to do things that don't make sense.
         overrides = args.get("overrides_from") or []
+        if overrides:
+            # Importing ansible is slow, so we do it only if we must.
+            from ansible.utils.vars import (  # pylint: disable=import-outside-toplevel
+                merge_hash,
+            )
         for f in overrides:
             extra_vars = self.load_yaml(f, args, loader=self.loader([os.getcwd()]))
             args.update(reduce(merge_hash, [args, extra_vars]))
@@ -677,40 +702,14 @@ class Architecture(object):
         address for each hostname, or None if no address was provided.
         """
 
-        env = {}
-        for arg in [
-            "hostnames_from",
-            "hostnames_pattern",
-            "hostnames_sorted_by",
-            "hostnames_unsorted",
-        ]:
-            if self.args[arg] is not None:
-                env[arg.upper()] = str(self.args[arg])
-
-        popen_params = {}
-
-        if int(str(sys.version_info.major) + str(sys.version_info.minor)) >= 36:
-            popen_params["encoding"] = sys.getdefaultencoding()
-
-        p = subprocess.Popen(
-            ["%s/hostnames" % self.lib, str(num)],
-            stdin=None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=env,
-            **popen_params,
+        names, addresses = select_hostnames(
+            num,
+            names_from=self.args["hostnames_from"],
+            pattern=self.args["hostnames_pattern"],
+            sorted_by=self.args["hostnames_sorted_by"],
+            unsorted=self.args["hostnames_unsorted"],
+            default_names="%s/hostnames.txt" % self.lib,
         )
-        (stdout, stderr) = p.communicate()
-
-        if p.returncode != 0:
-            raise ArchitectureError(stderr.strip())
-
-        names = []
-        addresses = []
-        for line in stdout.splitlines():
-            fields = line.split()
-            names.append(fields[0])
-            addresses.append(fields[1] if len(fields) > 1 else None)
         return ["zero"] + names, [None] + addresses
 
     def image(self):
@@ -769,7 +768,8 @@ class Architecture(object):
         subnets = self.net.subnets(limit=num)
         subnets.exclude(
             excludes=self._get_subnets_from(
-                exclude_dirs=self.args.get("exclude_subnet_dirs", [])
+                exclude_dirs=self.args.get("exclude_subnet_dirs", []),
+                registry=self.args.get("subnet_registry"),
             )
         )
 
@@ -789,7 +789,7 @@ class Architecture(object):
         return [str(s) for s in subnets]
 
     @staticmethod
-    def _get_subnets_from(exclude_dirs):
+    def _get_subnets_from(exclude_dirs, registry=None):
         """
         Look for subnet ranges defined in the cluster config directory list provided.
 
@@ -798,28 +798,24 @@ class Architecture(object):
 
         Args:
             exclude_dirs: List of directories to look in
+            registry: Path to a file in which to remember the subnets found in each directory, so that its
+                      config.yml need not be parsed again unless it has changed
 
         Returns: List of subnet ranges found
 
         """
+        subnet_registry = SubnetRegistry(registry)
+        try:
+            found = subnet_registry.lookup(exclude_dirs)
+        except FileNotFoundError as e:
+            raise ArchitectureError(
+                f"Could not open a config.yml file in the provided path: {os.path.dirname(e.filename)}"
+            )
+        subnet_registry.save()
+
         values = []
         for dir_name in exclude_dirs:
-            try:
-                with open(f"{dir_name}/config.yml") as exclude_config_yml:
-                    config_data = yaml.safe_load(exclude_config_yml)
-                    for key in ("instances", "locations"):
-                        values.extend(
-                            s["subnet"] for s in config_data.get(key) if s.get("subnet")
-                        )
-                    instance_default_subnet = config_data.get(
-                        "instance_defaults", {}
-                    ).get("subnet")
-                    if instance_default_subnet:
-                        values.append(instance_default_subnet)
-            except FileNotFoundError:
-                raise ArchitectureError(
-                    f"Could not open a config.yml file in the provided path: {dir_name}"
-                )
+            values.extend(found[dir_name])
         return list(set(values))
 
     def _init_locations(self, locations):
@@ -1515,16 +1511,36 @@ class Architecture(object):
         the output as YAML, and returns the resulting data structure
         """
         text = self.expand_template(filename, vars, loader)
-        return yaml.load(text, Loader=yaml.FullLoader)
+        return yaml.load(text, Loader=YamlLoader)
 
     def expand_template(self, filename, vars, loader=None):
         """
         Takes a template filename and some args and returns the template output
         """
+        from ansible.template import (  # pylint: disable=import-outside-toplevel
+            JINJA2_OVERRIDE,
+            Templar,
+        )
+
         loader = loader or self.loader()
         templar = Templar(loader=loader, variables=vars)
-        template = loader._tpaexec_get_template(filename)
-        return templar.do_template(template)
+        source = loader._tpaexec_get_template(filename)
+
+        # Templar applies any "#jinja2:" overrides to a copy of its environment,
+        # so we don't use our compiled code for such a template.
+        if source.startswith(JINJA2_OVERRIDE):
+            return templar.do_template(source)
+
+        template = loader.template(templar.environment, source)
+        text = "".join(
+            str(v) for v in template.generate(dict(template.globals, **vars))
+        )
+
+        # Jinja2 removes a trailing newline from the output, but Templar (and
+        # therefore this function) has always kept them.
+        missing = len(source) - len(source.rstrip("\n"))
+        missing -= len(text) - len(text.rstrip("\n"))
+        return text + "\n" * max(missing, 0)
 
     def loader(self, basedirs=None):
         """
@@ -1532,27 +1548,69 @@ class Architecture(object):
         architecture's template_directories(). If no matching template is found
         in those directories and an absolute path to an existing file is given,
         the loader will return the contents of that template directly.
+
+        The same loader (and therefore the same compiled templates) is
+        returned for the same basedirs every time, even to a different
+        Architecture.
         """
+        basedirs = tuple(basedirs or self.template_directories())
+        if basedirs not in template_loaders:
+            template_loaders[basedirs] = TemplateLoader(list(basedirs))
+        return template_loaders[basedirs]
 
-        class MinimalLoader(object):
-            _basedirs = []
 
-            def __init__(self, basedirs):
-                self._basedirs = basedirs
+class TemplateLoader(object):
+    """
+    A minimal stand-in for Ansible's DataLoader, which finds templates in a
+    list of directories, and remembers the code compiled for each template,
+    because the same template text may be expanded many times (with
+    different variables).
+    """
 
-            def get_basedir(self):
-                return self._basedirs[0]
+    def __init__(self, basedirs):
+        self._basedirs = basedirs
+        self._compiled = {}
+
+    def get_basedir(self):
+        return self._basedirs[0]
+
+    def _tpaexec_get_template(self, filename):
+        for d in self._basedirs:
+            text = read_template("%s/%s" % (d, filename))
+            if text is not None:
+                return text
+        if filename.startswith("/"):
+            text = read_template(filename)
+            if text is not None:
+                return text
+        return "{}"
+
+    def template(self, env, source):
+        """
+        Returns a new Template for the given source in the given Jinja2
+        environment, compiling the source only if we have not seen it before.
+        """
+        if source not in self._compiled:
+            self._compiled[source] = env.compile(source)
+        return env.template_class.from_code(
+            env, self._compiled[source], env.make_globals(None)
+        )
 
-            def _tpaexec_get_template(self, filename):
-                for d in self._basedirs:
-                    t = "%s/%s" % (d, filename)
-                    if os.path.exists(t):
-                        return io.open(t, "r", encoding="utf-8").read()
-                if filename.startswith("/") and os.path.exists(filename):
-                    return io.open(filename, "r", encoding="utf-8").read()
-                return "{}"
 
-        return MinimalLoader(basedirs or self.template_directories())
+def read_template(path):
+    """
+    Returns the contents of the given template file, or None if it does not
+    exist, reading it only if we have not already read the same version.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key not in template_cache:
+        with io.open(path, "r", encoding="utf-8") as f:
+            template_cache[key] = f.read()
+    return template_cache[key]
 
 
 def update_symlinks_recursively(source, destination, force):
@@ -2,8 +2,15 @@
 # -*- coding: utf-8 -*-
 # © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
 
+import csv
+import multiprocessing
 import os
+import shlex
+import sys
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
 
 from .bdr_always_on import BDR_Always_ON
 from .pgd_always_on import PGD_Always_ON
@@ -50,6 +57,9 @@ def configure(argv, tpa_dir=None):
 
     This directory needs to exist on the same level as the architectures/lib directory.
 
+    If `--manifest FILE` is given instead of a cluster directory, every cluster
+    listed in the manifest is configured by configure_many().
+
     """
     # Function argument `tpa_dir` takes precedence over environment variable
     try:
@@ -58,9 +68,37 @@ def configure(argv, tpa_dir=None):
     except TypeError:
         raise EnvironmentError("TPA_DIR not defined")
 
+    manifest_parser = ArgumentParser(
+        "tpaexec configure",
+        add_help=False,
+        allow_abbrev=False,
+        usage="%(prog)s --manifest FILE [--workers N]",
+    )
+    manifest_parser.add_argument("--manifest")
+    manifest_parser.add_argument("--workers", type=int, default=1)
+    manifest_args, _ = manifest_parser.parse_known_args(argv)
+    if manifest_args.manifest:
+        failures = [
+            (cluster, error)
+            for cluster, error in configure_many(
+                manifest_args.manifest, tpa_dir, workers=manifest_args.workers
+            )
+            if error
+        ]
+        for cluster, error in failures:
+            print(f"{cluster}: {error}", file=sys.stderr)
+        if failures:
+            raise ArchitectureError(
+                f"Could not configure {len(failures)} cluster(s) from {manifest_args.manifest}"
+            )
+        return None
+
     # Partially parse just the architecture argument to feed SelectArchitecture
     arch_parser = ArgumentParser(
-        "tpaexec configure", add_help=False, usage="%(prog)s <cluster> -a Architecture"
+        "tpaexec configure",
+        add_help=False,
+        allow_abbrev=False,
+        usage="%(prog)s <cluster> -a Architecture",
     )
     arch_parser.add_argument("--architecture", "-a", required=True)
     arch_args, _ = arch_parser.parse_known_args(argv)
@@ -77,3 +115,116 @@ def configure(argv, tpa_dir=None):
     )
     architecture.configure()
     return architecture
+
+
+def manifest_argv(entry, defaults=None):
+    """
+    Returns the `tpaexec configure` arguments for one cluster in a manifest.
+
+    Each entry maps option names (with or without the leading dashes, and with
+    underscores or dashes) to values: `true` adds the option as a flag, `false`
+    or an empty value omits it, and a list is given as multiple arguments to
+    the option. The `cluster` key is required, and `args` may specify any
+    further arguments verbatim (as a list or a shell-quoted string).
+    """
+    entry = {**(defaults or {}), **entry}
+    args = entry.pop("args", None)
+    try:
+        argv = [str(entry.pop("cluster"))]
+    except KeyError:
+        raise ArchitectureError(f"No cluster specified in manifest entry: {entry}")
+
+    for name, value in entry.items():
+        if value is None or value is False or value == "":
+            continue
+        option = "--" + name.lstrip("-").replace("_", "-")
+        if value is True:
+            argv.append(option)
+        elif isinstance(value, list):
+            argv.append(option)
+            argv.extend(str(v) for v in value)
+        else:
+            argv.extend([option, str(value)])
+
+    if isinstance(args, str):
+        argv.extend(shlex.split(args))
+    elif args:
+        argv.extend(str(a) for a in args)
+    return argv
+
+
+def load_manifest(path):
+    """
+    Returns a list of `tpaexec configure` argument lists, one for each cluster
+    in the given manifest, which may be either a CSV file with a header row
+    naming the options, or a YAML file containing a list of entries (or a
+    mapping with `defaults` to apply to each of the entries under `clusters`).
+    """
+    try:
+        with open(path, newline="") as f:
+            if path.endswith(".csv"):
+                defaults, entries = {}, list(csv.DictReader(f))
+            else:
+                manifest = yaml.safe_load(f) or []
+                if isinstance(manifest, dict):
+                    defaults = manifest.get("defaults") or {}
+                    entries = manifest.get("clusters") or []
+                else:
+                    defaults, entries = {}, manifest
+    except (OSError, yaml.YAMLError, csv.Error) as e:
+        raise ArchitectureError(f"Could not read manifest {path}: {e}")
+
+    if not isinstance(defaults, dict) or not isinstance(entries, list):
+        raise ArchitectureError(f"Invalid manifest {path}")
+    return [manifest_argv(entry, defaults) for entry in entries]
+
+
+def _configure_one(argv, tpa_dir):
+    """
+    Configures a single cluster for configure_many(), and returns a tuple of the
+    cluster directory and an error message (or None if there was no error).
+    """
+    try:
+        configure(argv, tpa_dir)
+    except SystemExit as e:
+        # argparse has already explained the problem on stderr.
+        return argv[0], f"invalid arguments (exit status {e.code})"
+    except Exception as e:
+        message = getattr(e, "MSG", e.__class__.__name__)
+        return argv[0], f"{message}: {e}"
+    return argv[0], None
+
+
+def configure_many(manifest, tpa_dir=None, workers=1):
+    """
+    Configures every cluster listed in the given manifest file (see
+    load_manifest) in this process, so that the cost of starting up and of
+    loading architectures, platforms, and templates is paid only once, rather
+    than once per cluster. With workers > 1, clusters are configured in that
+    many forked processes, which inherit everything loaded so far (or one at a
+    time if processes cannot be forked on this platform).
+
+    Returns a list of (cluster, error) tuples in manifest order, where error is
+    None if the cluster was configured successfully.
+    """
+    tpa_dir = tpa_dir or os.environ.get("TPA_DIR", None)
+    argvs = load_manifest(manifest)
+
+    clusters = [argv[0] for argv in argvs]
+    duplicates = sorted(set(c for c in clusters if clusters.count(c) > 1))
+    if duplicates:
+        raise ArchitectureError(
+            f"Duplicate clusters in manifest {manifest}: {', '.join(duplicates)}"
+        )
+
+    # We can't use the "spawn" method, because it would re-run the calling
+    # script in each worker.
+    if (
+        workers > 1
+        and len(argvs) > 1
+        and "fork" in multiprocessing.get_all_start_methods()
+    ):
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            return list(pool.map(_configure_one, argvs, [tpa_dir] * len(argvs)))
+    return [_configure_one(argv, tpa_dir) for argv in argvs]
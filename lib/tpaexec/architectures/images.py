@@ -5,9 +5,13 @@
 from ..architecture import Architecture
 
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from ..exceptions import ImagesArchitectureError
 
+# The maximum number of images to look up at once.
+IMAGE_LOOKUP_WORKERS = 8
+
 
 class Images(Architecture):
     def add_architecture_options(self, p, g):
@@ -88,9 +92,11 @@ class Images(Architecture):
                 "Please use --distributions (not --distribution) for this architecture"
             )
 
+        images = self.lookup_images(regions, distributions)
+
         for i, r in enumerate(regions):
             for j, d in enumerate(distributions):
-                image = self.platform.image(d, lookup=True, region=r)
+                image = images[(r, d)]
                 instance = {
                     "node": i * len(distributions) + j + 1,
                     "Name": ("%s-%s" % (re.sub("[^a-zA-Z0-9-]", "-", d), r)).lower(),
@@ -103,6 +109,34 @@ class Images(Architecture):
 
         args.update({"instances": instances})
 
+    def lookup_images(self, regions, distributions):
+        """
+        Returns a dict mapping each (region, distribution) pair to the result
+        of looking up the corresponding image. The lookups are independent (and
+        slow, on AWS), so we do them concurrently, and report all failures at
+        once after all of them have finished.
+        """
+        pairs = [(r, d) for r in regions for d in distributions]
+        workers = max(1, min(IMAGE_LOOKUP_WORKERS, len(pairs)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(self.platform.image, d, lookup=True, region=r)
+                for r, d in pairs
+            ]
+
+        images = {}
+        errors = []
+        for (r, d), f in zip(pairs, futures):
+            try:
+                images[(r, d)] = f.result()
+            except Exception as e:
+                errors.append(f"{d} in {r}: {e}")
+        if errors:
+            raise ImagesArchitectureError(
+                "Could not look up %d image(s): %s" % (len(errors), "; ".join(errors))
+            )
+        return images
+
     def update_locations(self, locations):
         for i, r in enumerate(self.args["regions"]):
             locations[i]["region"] = r
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+"""
+Selects hostnames (and optional addresses) for a cluster's instances from a
+list of names, which is either the default list in architectures/lib or a
+file given with --hostnames-from.
+"""
+
+import os
+import random
+import re
+from typing import List, Optional, Tuple
+
+from .exceptions import ArchitectureError
+
+DEFAULT_PATTERN = "[a-zA-Z0-9-]+( +[0-9a-f.:]+)?"
+
+# POSIX character classes that may appear in an egrep pattern, and their
+# equivalents in a Python regular expression character set.
+POSIX_CLASSES = {
+    "[:alnum:]": "a-zA-Z0-9",
+    "[:alpha:]": "a-zA-Z",
+    "[:blank:]": " \\t",
+    "[:digit:]": "0-9",
+    "[:lower:]": "a-z",
+    "[:space:]": "\\s",
+    "[:upper:]": "A-Z",
+    "[:xdigit:]": "0-9a-fA-F",
+}
+
+
+# The sort(1) options we understand in --hostnames-sorted-by, each mapped to
+# its short form.
+SORT_OPTIONS = {
+    "-d": "-d",
+    "--dictionary-order": "-d",
+    "-R": "-R",
+    "--random-sort": "-R",
+}
+
+
+def dictionary_order(s):
+    return re.sub(r"[^a-zA-Z0-9\s]", "", s)
+
+
+# The lines of each names file we have read, keyed by (path, mtime, size),
+# and the lines of each that match a given pattern, keyed by (file, pattern).
+names_files = {}
+matching_lines = {}
+
+Hostnames = Tuple[List[str], List[Optional[str]]]
+
+
+def read_names(path: str) -> Tuple[tuple, List[str]]:
+    """
+    Returns the lines in the given file, reading it only once per version,
+    along with the key under which they are remembered.
+    """
+    try:
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        if key not in names_files:
+            with open(path, errors="replace") as f:
+                names_files[key] = f.read().splitlines()
+    except OSError:
+        raise ArchitectureError(f"could not open hostname list: {path}")
+    return key, names_files[key]
+
+
+def egrep_pattern(pattern: str):
+    """Compiles an egrep pattern, translating any POSIX character classes."""
+    for k, v in POSIX_CLASSES.items():
+        pattern = pattern.replace(k, v)
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ArchitectureError(f"invalid hostnames pattern '{pattern}': {e}")
+
+
+def matching_names(path: str, pattern: str) -> List[str]:
+    """Returns the lines in the given file that match the given pattern."""
+    file_key, lines = read_names(path)
+    key = (file_key, pattern)
+    if key not in matching_lines:
+        regex = egrep_pattern(pattern)
+        matching_lines[key] = [l for l in lines if l.strip() and regex.fullmatch(l)]
+    return matching_lines[key]
+
+
+def sort_names(names: List[str], sorted_by: str) -> List[str]:
+    """
+    Sorts names as sort(1) would with the given options, except that strings
+    are compared by code point rather than in the collation order of the
+    current locale.
+    """
+    options = []
+    for option in sorted_by.split():
+        if option.startswith("--") or len(option) <= 2:
+            options.append(option)
+        else:
+            options.extend("-" + o for o in option[1:])
+
+    unknown = [o for o in options if o not in SORT_OPTIONS]
+    if unknown:
+        supported = sorted(set(SORT_OPTIONS.values()), key=str.lower)
+        raise ArchitectureError(
+            f"unsupported --hostnames-sorted-by option: {' '.join(unknown)} "
+            f"(supported: {' '.join(supported)}, or their long forms)"
+        )
+    options = set(SORT_OPTIONS[o] for o in options)
+
+    if "-R" in options:
+        return random.sample(names, len(names))
+
+    # As with sort(1), names that compare equal are ordered by their full
+    # text as a last resort.
+    if "-d" in options:
+        return sorted(names, key=lambda s: (dictionary_order(s), s))
+    return sorted(names)
+
+
+def select_hostnames(
+    num: int,
+    names_from: Optional[str] = None,
+    pattern: Optional[str] = None,
+    sorted_by: Optional[str] = None,
+    unsorted: bool = False,
+    default_names: Optional[str] = None,
+) -> Hostnames:
+    """
+    Returns the first num lines matching the pattern in the names file (sorted
+    in random order by default, but only when using the default names file) as
+    a list of hostnames and a corresponding list of addresses (or None for
+    names without an address).
+    """
+    path = names_from or default_names
+    pattern = pattern or DEFAULT_PATTERN
+    names = matching_names(path, pattern)
+
+    if unsorted or (names_from is not None and names_from != default_names):
+        ordered = names
+    elif SORT_OPTIONS.get(sorted_by or "-R") == "-R":
+        # We need only num names, not a shuffled copy of the whole list.
+        ordered = random.sample(names, min(num, len(names)))
+    else:
+        ordered = sort_names(names, sorted_by)
+
+    if len(ordered) < num:
+        raise ArchitectureError(
+            f"found only {len(ordered)}/{num} names matching '{pattern}' in {os.path.realpath(path)}"
+        )
+    selected = ordered[:num]
+
+    hostnames = []
+    addresses = []
+    for line in selected:
+        fields = line.split()
+        hostnames.append(fields[0])
+        addresses.append(fields[1] if len(fields) > 1 else None)
+    return hostnames, addresses
@@ -4,13 +4,25 @@
 """IP network operations."""
 
 
+import json
+import multiprocessing
+import os
+import tempfile
 from argparse import ArgumentParser
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from ipaddress import IPv4Network, ip_network
-from random import shuffle
-from typing import Iterator, MutableSequence, List
+from itertools import accumulate, islice
+from random import randrange, shuffle
+from typing import Dict, Iterator, MutableSequence, List, Tuple
+
+import yaml
 
 from .exceptions import NetError
 
+# The C implementation of the YAML parser is much faster, if it is available.
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 DEFAULT_NETWORK_CIDR = "10.33.0.0/16"
 DEFAULT_SUBNET_PREFIX_LENGTH = 28
 
@@ -71,6 +83,10 @@ class Subnets:
         """
         Supply initial values for calculating number of subnets and their sizes for the given network.
 
+        The subnets are not materialised up front. Instead, we number them from 0 to 2**(new_prefix-prefixlen)-1
+        and keep track of the free ones as a sorted list of disjoint [start, end) intervals of subnet numbers,
+        from which we draw subnets sequentially or at random only as they are needed.
+
         Args:
             limit: Limit number of subnets
             cidr: Initial network range using CIDR notation
@@ -81,6 +97,9 @@ class Subnets:
         self.limit = limit
         self.new_prefix = new_prefix
         self._ranges = None
+        self._free = None
+        self._shuffled = False
+        self._drawn = []
 
     def validate(self):
         """Validate the prefix length restrictions."""
@@ -94,7 +113,16 @@ class Subnets:
     def ranges(self) -> TypeSubnets:
         """Calculate and store subnet ranges for the defined IP network."""
         if self._ranges is None:
-            self._ranges = list(self.__get_subnet_ranges(self.cidr))
+            ranges = list(self.__get_subnet_ranges())
+            if self._shuffled:
+                # Any subnets we have already drawn at random come first, so that the order is consistent with
+                # what slice() has returned so far.
+                drawn = [self.__subnet(n) for n in self._drawn]
+                seen = set(drawn)
+                ranges = [r for r in ranges if r not in seen]
+                shuffle(ranges)
+                ranges = drawn + ranges
+            self._ranges = ranges
         return self._ranges
 
     @ranges.setter
@@ -102,26 +130,95 @@ class Subnets:
         """Setter method for ranges property."""
         self._ranges = value
 
-    def __get_subnet_ranges(self, net: IPv4Network) -> TypeNets:
-        """Return a generator object with the subnets for the defined network according to new_prefix length."""
-        self.validate()
-        return net.subnets(new_prefix=self.new_prefix)
+    @property
+    def free(self) -> List[Tuple[int, int]]:
+        """Return the [start, end) intervals of subnet numbers that are available for use."""
+        if self._free is None:
+            self.validate()
+            self._free = [(0, 1 << (self.new_prefix - self.cidr.prefixlen))]
+        return self._free
+
+    def __get_subnet_ranges(self) -> TypeNets:
+        """Return a generator object with the available subnets for the defined network in ascending order."""
+        for start, end in self.free:
+            for n in range(start, end):
+                yield self.__subnet(n)
+
+    def __subnet(self, n: int) -> IPv4Network:
+        """Return the subnet with the given number."""
+        shift = self.cidr.max_prefixlen - self.new_prefix
+        address = int(self.cidr.network_address) + (n << shift)
+        return self.cidr.__class__((address, self.new_prefix))
 
     def exclude(self, excludes: Iterator[str]) -> None:
         """Remove any subnet in stored ranges which overlaps with any range in an excludes list of CIDR addresses."""
-        self.ranges = list(
-            r
-            for r in self.ranges
-            if not any(map(r.overlaps, map(ip_network, excludes)))
-        )
+        nets = [ip_network(e) for e in excludes]
+        nets = [n for n in nets if n.version == self.cidr.version]
+
+        if self._ranges is not None:
+            self.ranges = list(r for r in self.ranges if not any(map(r.overlaps, nets)))
+            return
+
+        # Each excluded network overlaps a contiguous interval of subnets, which we subtract from the free list.
+        shift = self.cidr.max_prefixlen - self.new_prefix
+        first = int(self.cidr.network_address)
+        last = int(self.cidr.broadcast_address)
+        free = self.free
+        for net in nets:
+            lo, hi = int(net.network_address), int(net.broadcast_address)
+            if hi < first or lo > last:
+                continue
+            start = (max(lo, first) - first) >> shift
+            end = ((min(hi, last) - first) >> shift) + 1
+            free = [
+                interval
+                for a, b in free
+                for interval in ((a, min(b, start)), (max(a, end), b))
+                if interval[0] < interval[1]
+            ]
+        self._free = free
+        self._drawn = []
 
     def shuffle(self) -> None:
         """Randomise the order of the stored subnets ranges."""
-        shuffle(self.ranges)
+        if self._ranges is not None:
+            shuffle(self.ranges)
+        else:
+            self.validate()
+            self._shuffled = True
+            self._drawn = []
+
+    def __draw(self, num: int) -> List[int]:
+        """
+        Return a list of num distinct subnet numbers drawn at random from the free intervals, extending (and
+        remembering) the list drawn previously.
+        """
+        counts = list(accumulate(b - a for a, b in self.free))
+        drawn = set(self._drawn)
+        while len(self._drawn) < num:
+            k = randrange(counts[-1])
+            i = bisect_right(counts, k)
+            n = self.free[i][1] - (counts[i] - k)
+            if n not in drawn:
+                drawn.add(n)
+                self._drawn.append(n)
+        return self._drawn[:num]
 
     def slice(self, num: int = None) -> List:
         """Return a list with the first num nets in nets or stored subnet ranges."""
-        return list(self.ranges[: num or self.limit])
+        num = num or self.limit
+
+        # We draw a few random subnets from a large free space without materialising all of them, but if we need
+        # more than half of them, it's cheaper to shuffle the list (and that avoids too many retries in __draw).
+        if self._ranges is None and self._shuffled:
+            total = sum(b - a for a, b in self.free)
+            if num <= total // 2:
+                return [self.__subnet(n) for n in self.__draw(num)]
+
+        if self._ranges is not None or self._shuffled:
+            return list(self.ranges[:num])
+
+        return list(islice(self.__get_subnet_ranges(), num))
 
     def __repr__(self) -> str:
         """String representation of class object."""
@@ -140,6 +237,107 @@ class Subnets:
         return self.slice()[item]
 
 
+def config_subnets(path: str) -> List[str]:
+    """Return the subnets declared for instances and locations and in instance_defaults in the given config.yml."""
+    with open(path) as config_yml:
+        config_data = yaml.load(config_yml, Loader=YamlLoader) or {}
+
+    values = []
+    for key in ("instances", "locations"):
+        values.extend(
+            s["subnet"] for s in config_data.get(key) or [] if s.get("subnet")
+        )
+    instance_default_subnet = (config_data.get("instance_defaults") or {}).get("subnet")
+    if instance_default_subnet:
+        values.append(instance_default_subnet)
+    return values
+
+
+class SubnetRegistry:
+    """
+    A record of the subnets declared in the config.yml of cluster directories, kept in a JSON file (if a path is
+    given) along with the mtime and size of each config.yml, so that we need to parse a config.yml again only if it
+    has changed since the registry was last updated.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Load the registry from the given path, if it exists.
+
+        Args:
+            path: Path to the registry file, or None to keep the registry only in memory.
+
+        """
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        if path:
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.entries = data["dirs"]
+            except (OSError, ValueError, KeyError, AttributeError):
+                self.entries = {}
+
+    def lookup(self, dirs: List[str]) -> Dict[str, List[str]]:
+        """
+        Return a dict mapping each of the given directories to the subnets declared in its config.yml, parsing
+        (in parallel) only the files that are not in the registry or have changed since they were recorded.
+
+        Raises FileNotFoundError if a directory does not contain a config.yml.
+        """
+        found = {}
+        stale = {}
+        for d in dirs:
+            key = os.path.abspath(d)
+            st = os.stat(os.path.join(d, "config.yml"))
+            stamp = [st.st_mtime_ns, st.st_size]
+            entry = self.entries.get(key)
+            if entry and entry["stamp"] == stamp:
+                found[d] = entry["subnets"]
+            else:
+                stale[d] = (key, stamp)
+
+        paths = [os.path.join(d, "config.yml") for d in stale]
+        for d, subnets in zip(stale, self._parse(paths)):
+            key, stamp = stale[d]
+            self.entries[key] = {"stamp": stamp, "subnets": subnets}
+            self.changed = True
+            found[d] = subnets
+
+        return found
+
+    @staticmethod
+    def _parse(paths: List[str]) -> List[List[str]]:
+        """Return the subnets declared in each of the given files, using a pool of processes if there are many."""
+        workers = min(os.cpu_count() or 1, len(paths))
+        # We can't use the "spawn" method, because it would re-run the calling script in each worker.
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                return list(pool.map(config_subnets, paths, chunksize=16))
+        return [config_subnets(p) for p in paths]
+
+    def save(self) -> None:
+        """Write the registry back to its file (atomically), if anything has changed."""
+        if not self.path or not self.changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".subnets")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": self.VERSION, "dirs": self.entries}, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.changed = False
+
+
 def main():  # pragma: no cover
     """Function is executed when this module is ran as a command line script."""
     parser = ArgumentParser()
@@ -9,6 +9,9 @@ from ..exceptions import PlatformError
 
 DEFAULT_VOLUME_DEVICE_NAME = "/dev/sd"
 
+# The Platform subclass for each platform name we have already loaded.
+platform_classes = {}
+
 
 class Platform:
     """
@@ -26,12 +29,12 @@ class Platform:
         Returns an object of the desired Platform subclass
         """
         name = Platform.guess_platform(args) or arch.default_platform()
-        module = "tpaexec.platforms.%s" % name
-        if not importlib.util.find_spec(module):
-            raise PlatformError("Unknown platform: %s" % name)
-
-        p = getattr(__import__(module, fromlist=[name]), name)
-        return p(name, arch)
+        if name not in platform_classes:
+            module = "tpaexec.platforms.%s" % name
+            if not importlib.util.find_spec(module):
+                raise PlatformError("Unknown platform: %s" % name)
+            platform_classes[name] = getattr(__import__(module, fromlist=[name]), name)
+        return platform_classes[name](name, arch)
 
     @staticmethod
     def guess_platform(args):
@@ -2,11 +2,16 @@
 # -*- coding: utf-8 -*-
 # © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
 
-import boto3
+import json
+import os
+import tempfile
+import threading
+import time
 
 from . import CloudPlatform
 from ..exceptions import AWSPlatformError
 
+AWS_AMI_CACHE_TTL = 86400
 AWS_DEFAULT_INSTANCE_TYPE = "t3.micro"
 AWS_DEFAULT_REGION = "eu-west-1"
 AWS_DEFAULT_VOLUME_DEVICE_NAME = "/dev/xvd"
@@ -31,10 +36,89 @@ AWS_ZONES_PER_REGION = {
 }
 
 
+class AmiCache:
+    """
+    A record of the AMI ids found by looking up images by (region, name, owner),
+    kept in a JSON file (if a path is given) so that other configure runs can
+    reuse them without calling describe_images until they expire.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, ttl=AWS_AMI_CACHE_TTL, refresh=False):
+        """
+        Load the cache from the given path, if it exists. If refresh is set,
+        every image is looked up again (and the new results saved).
+        """
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+        self.entries = self._load()
+        self.changed = {}
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                return dict(data["images"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+        return {}
+
+    @staticmethod
+    def key(region, name, owner):
+        return json.dumps([region, name, owner])
+
+    def get(self, region, name, owner=None):
+        """
+        Returns the cached id of the given image, or None if it is not known or
+        the entry has expired.
+        """
+        if self.refresh:
+            return None
+        entry = self.entries.get(self.key(region, name, owner))
+        if entry and time.time() - entry["time"] < self.ttl:
+            return entry["image_id"]
+        return None
+
+    def put(self, region, name, owner, image_id):
+        k = self.key(region, name, owner)
+        self.entries[k] = self.changed[k] = {"image_id": image_id, "time": time.time()}
+
+    def save(self):
+        """
+        Writes new entries back to the file (atomically), merging them with any
+        that were written by someone else in the meantime.
+        """
+        if not self.path or not self.changed:
+            return
+        entries = self._load()
+        entries.update(self.changed)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".ami-cache")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": self.VERSION, "images": entries}, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.entries = entries
+        self.changed = {}
+
+
 class aws(CloudPlatform):
     def __init__(self, name, arch):
         super().__init__(name, arch)
         self.ec2 = {}
+        self._ami_cache = None
+        # Images may be looked up from several threads at once, so we must
+        # serialise creating ec2 clients and updating the AMI cache.
+        self._lock = threading.Lock()
         self.preferred_python_version = "python3"
 
     @property
@@ -62,6 +146,24 @@ class aws(CloudPlatform):
             "--instance-type", default=AWS_DEFAULT_INSTANCE_TYPE, metavar="TYPE"
         )
         g.add_argument("--cluster-bucket")
+        g.add_argument(
+            "--ami-cache",
+            metavar="FILE",
+            default=os.environ.get("TPA_AMI_CACHE"),
+            help="file in which to remember the results of AMI lookups",
+        )
+        g.add_argument(
+            "--ami-cache-ttl",
+            metavar="SECONDS",
+            type=int,
+            default=AWS_AMI_CACHE_TTL,
+            help="how long to use remembered AMI lookup results",
+        )
+        g.add_argument(
+            "--refresh-ami-cache",
+            action="store_true",
+            help="look up every AMI again, ignoring any remembered results",
+        )
 
     def supported_distributions(self):
         return [
@@ -211,9 +313,35 @@ class aws(CloudPlatform):
 
         return image
 
+    @property
+    def ami_cache(self):
+        with self._lock:
+            if self._ami_cache is None:
+                args = self.arch.args
+                self._ami_cache = AmiCache(
+                    args.get("ami_cache"),
+                    ttl=args.get("ami_cache_ttl", AWS_AMI_CACHE_TTL),
+                    refresh=args.get("refresh_ami_cache", False),
+                )
+            return self._ami_cache
+
     def _lookup_ami(self, image, region):
-        if region not in self.ec2:
-            self.ec2[region] = boto3.client("ec2", region_name=region)
+        v = self.arch.args["verbosity"]
+        owner = image.get("owner")
+        cache = self.ami_cache
+        image_id = cache.get(region, image["name"], owner)
+        if image_id:
+            if v > 0:
+                print('aws: Found AMI "%s" in "%s" in cache' % (image["name"], region))
+            return {"image_id": image_id}
+
+        with self._lock:
+            if region not in self.ec2:
+                # boto3 takes a long time to import, and most configurations
+                # never need to look up an AMI, so we import it only when we must.
+                import boto3  # pylint: disable=import-outside-toplevel
+
+                self.ec2[region] = boto3.client("ec2", region_name=region)
         filters = [
             {"Name": "name", "Values": [image["name"]]},
         ]
@@ -224,7 +352,6 @@ class aws(CloudPlatform):
                     "Values": [image["owner"]],
                 }
             )
-        v = self.arch.args["verbosity"]
         if v > 0:
             print('aws: Looking up AMI "%s" in "%s"' % (image["name"], region))
         r = self.ec2[region].describe_images(Filters=filters)
@@ -235,7 +362,11 @@ class aws(CloudPlatform):
             raise AWSPlatformError(
                 "Expected 1 match for %s, found %d" % (image["name"], n)
             )
-        return {"image_id": r["Images"][0]["ImageId"]}
+        image_id = r["Images"][0]["ImageId"]
+        with self._lock:
+            cache.put(region, image["name"], owner, image_id)
+            cache.save()
+        return {"image_id": image_id}
 
     def update_cluster_tags(self, cluster_tags, args, **kwargs):
         if args["owner"] is not None:
@@ -54,7 +54,15 @@
 from __future__ import absolute_import, division, print_function
 
 import os, io, pwd, grp
+import collections
+import contextlib
+import json
+import re
+import tempfile
+import threading
+import time
 import traceback
+from multiprocessing.pool import ThreadPool
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -81,6 +89,52 @@ options:
       - A conninfo string for this instance
     required: false
     default: "''"
+  workers:
+    description:
+      - The number of databases to examine in parallel, each over its own
+        connection. No more than this many connections are opened at once
+        in addition to the main connection.
+    required: false
+    default: 1
+  sections:
+    description:
+      - A list of the sections of cluster_facts to collect, or C(all). Any
+        other sections that a requested section depends on are collected
+        too. The version, port, and data directory are always collected.
+      - C(settings) collects pg_settings.
+      - C(system) collects the postgres binary directory, user, and group.
+      - C(replication) collects the role of this instance, the replication
+        catalogs, and (on a replica) details of its upstream.
+      - C(databases) collects the list of databases, and C(schemas),
+        C(extensions), C(pglogical), and C(bdr) collect details about each
+        database (and each depends on C(databases)).
+      - C(repmgr) collects repmgr configuration and nodes.
+      - C(roles) collects the list of roles.
+    required: false
+    type: list
+    default: [all]
+  cache:
+    description:
+      - The path to a file on the target in which to remember the results
+        of this discovery, along with fingerprints of the catalogs they
+        were derived from. On the next run, we reuse the remembered results
+        for pg_settings, pg_database, roles, and each database's schemas
+        and extensions if their fingerprints have not changed.
+      - The file includes password hashes from pg_authid, and is created
+        with mode 0600. It is not written in check mode.
+    required: false
+    default: "''"
+  timings:
+    description:
+      - If set, cluster_facts will include a C(_timings) dict that maps the
+        name of each discovery function (under C(functions)) to the number
+        of times it was called, the total time it took, and the number of
+        queries it executed and result rows it fetched; and also maps each
+        top-level key in cluster_facts (under C(sizes)) to the size of its
+        value in bytes when serialised as JSON.
+    required: false
+    type: bool
+    default: false
 notes:
    - This module requires the I(psycopg2) Python library to be installed.
 requirements: [ psycopg2 ]
@@ -94,8 +148,43 @@ EXAMPLES = """
   become_user: "{{ postgres_user }}"
   become: yes
 - debug: msg="the data directory is {{ cluster_facts.postgres_data_dir }}"
+
+- name: Find out if this instance is a primary or a replica
+  cluster_discovery:
+    conninfo: dbname=postgres
+    sections: [replication]
+  become_user: "{{ postgres_user }}"
+  become: yes
+- debug: msg="this instance is a {{ cluster_facts.role }}"
+
+- name: Collect facts, reusing unchanged results from the last run
+  cluster_discovery:
+    conninfo: dbname=postgres
+    cache: "{{ postgres_home }}/.cluster_facts.json"
+  become_user: "{{ postgres_user }}"
+  become: yes
 """
 
+# Each section of cluster_facts may be requested by name, and maps to a list
+# of the other sections that it depends on.
+
+SECTIONS = {
+    "settings": [],
+    "system": [],
+    "replication": [],
+    "databases": [],
+    "schemas": ["databases"],
+    "extensions": ["databases"],
+    "pglogical": ["databases"],
+    "bdr": ["databases"],
+    "repmgr": ["databases"],
+    "roles": [],
+}
+
+# These sections are collected by connecting to each database in turn.
+
+DATABASE_SECTIONS = ["schemas", "extensions", "pglogical", "bdr"]
+
 
 def main():
     # We need to connect to Postgres as a superuser. The caller must provide a
@@ -106,85 +195,160 @@ def main():
         supports_check_mode=True,
         argument_spec=dict(
             conninfo=dict(default=""),
+            workers=dict(type="int", default=1),
+            sections=dict(type="list", default=["all"]),
+            cache=dict(default=""),
+            timings=dict(type="bool", default=False),
         ),
     )
 
     if not psycopg2_found:
         module.fail_json(msg="the python psycopg2 module is required")
 
+    try:
+        sections = resolve_sections(module.params["sections"])
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+
     register_casts()
+    timings.enabled = module.params["timings"]
 
     m = {}
     m["changed"] = False
 
     conn = None
+    pool = ConnectionPool(module.params["conninfo"], module.params["workers"])
+    cache = FactsCache(module.params["cache"])
     try:
         conn = psycopg2.connect(dsn=module.params["conninfo"])
-        m.update({"ansible_facts": {"cluster_facts": cluster_discovery(module, conn)}})
+        m.update(
+            {
+                "ansible_facts": {
+                    "cluster_facts": cluster_discovery(
+                        module, conn, pool, sections, cache
+                    )
+                }
+            }
+        )
+        if not module.check_mode:
+            try:
+                cache.save()
+            except (IOError, OSError) as e:
+                module.warn("could not write %s: %s" % (cache.path, e))
     except Exception as e:
         m["error"] = str(e)
         m["exception"] = traceback.format_exc()
+    finally:
+        pool.close()
+        if conn is not None:
+            conn.close()
 
     module.exit_json(failed=("error" in m), **m)
 
 
-def cluster_discovery(module, conn):
+def resolve_sections(names):
+    """
+    Takes a list of section names (or ["all"]) and returns the set of those
+    sections along with any others they depend on. Raises ValueError if any
+    of the names is unknown.
+    """
+    if "all" in names:
+        return set(SECTIONS)
+
+    unknown = [n for n in names if n not in SECTIONS]
+    if unknown:
+        raise ValueError(
+            "unknown sections: %s (expected any of: all, %s)"
+            % (", ".join(unknown), ", ".join(sorted(SECTIONS)))
+        )
+
+    sections = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in sections:
+            sections.add(name)
+            pending.extend(SECTIONS[name])
+
+    return sections
+
+
+def cluster_discovery(module, conn, pool, sections, cache):
     m = dict()
-    cur = conn.cursor()
+
+    # We ask the server for everything we need to know about it in a single
+    # query, which returns one JSON object for us to pick apart below. Each
+    # round-trip can be expensive if we're far away from the server.
+
+    with timings.measure("server_facts"):
+        facts = server_facts(conn, sections, cache)
 
     # First, we discover postgres_version and its variants.
 
-    cur.execute("SELECT version()")
-    m["postgres_version_string"] = cur.fetchone()[0]
+    m["postgres_version_string"] = facts["version"]
     m["postgres_version_int"] = conn.server_version
     m["postgres_version"] = major_version(conn.server_version)
 
-    # We collect and return everything in pg_settings, and use that to also
-    # fill in postgres_data_dir and postgres_port. (There's no easy way to
+    # We always fill in postgres_data_dir and postgres_port, and return
+    # everything in pg_settings if requested. (There's no easy way to
     # discover postgres_host, but we wouldn't have been able to connect to
     # Postgres in the first place if we didn't have a pretty good idea of
     # what it was set to.)
 
-    m["pg_settings"] = settings = {}
-    cur.execute("SELECT name,setting FROM pg_catalog.pg_settings")
-    for s in cur.fetchall():
-        settings.update({s[0]: s[1]})
+    m["postgres_port"] = int(facts["port"])
+    m["postgres_data_dir"] = facts["data_directory"]
 
-    m["postgres_port"] = int(settings["port"])
-    m["postgres_data_dir"] = settings["data_directory"]
+    if "settings" in sections:
+        m["pg_settings"] = facts["pg_settings"]
 
     # A backend pid leads us to /proc/<pid>/{exe,status}, whence we can find
     # postgres_bin_dir, postgres_user, postgres_group, and postgres_home. We
     # assume that we are either running as root, or have permission to read
     # this because we're running as the same user as postgres.
 
-    cur.execute("SELECT pg_backend_pid()")
-    pid = cur.fetchone()[0]
-    m["postgres_bin_dir"] = os.path.dirname(os.readlink("/proc/%d/exe" % pid))
+    if "system" in sections:
+        with timings.measure("system_discovery"):
+            pid = facts["pg_backend_pid"]
+            m["postgres_bin_dir"] = os.path.dirname(os.readlink("/proc/%d/exe" % pid))
 
-    for line in io.open("/proc/%d/status" % pid, "r"):
-        s = line.split()
+            for line in io.open("/proc/%d/status" % pid, "r"):
+                s = line.split()
 
-        if not s:
-            continue
+                if not s:
+                    continue
 
-        if s[0] == "Uid:":
-            ent = pwd.getpwuid(int(s[1]))
-            m["postgres_user"] = ent.pw_name
-            m["postgres_home"] = ent.pw_dir
+                if s[0] == "Uid:":
+                    ent = pwd.getpwuid(int(s[1]))
+                    m["postgres_user"] = ent.pw_name
+                    m["postgres_home"] = ent.pw_dir
 
-        elif s[0] == "Gid:":
-            ent = grp.getgrgid(int(s[1]))
-            m["postgres_group"] = ent.gr_name
+                elif s[0] == "Gid:":
+                    ent = grp.getgrgid(int(s[1]))
+                    m["postgres_group"] = ent.gr_name
 
     # We're done with the basic system facts, so we move on to querying the
     # server to get an idea of its place in the world^Wcluster.
 
-    m.update(catalog_discovery(module, conn, m))
-    m.update(replica_discovery(module, conn, m))
-    m.update(database_discovery(module, conn, m))
-    m.update(repmgr_discovery(module, conn, m))
-    m.update(role_discovery(module, conn, m))
+    if "replication" in sections:
+        with timings.measure("catalog_discovery"):
+            m.update(catalog_discovery(module, conn, m, facts))
+        with timings.measure("replica_discovery"):
+            m.update(replica_discovery(module, conn, m, facts))
+    if "databases" in sections:
+        with timings.measure("database_discovery"):
+            m.update(database_discovery(module, conn, m, facts, pool, sections, cache))
+    if "repmgr" in sections:
+        with timings.measure("repmgr_discovery"):
+            m.update(repmgr_discovery(module, conn, m, facts, pool))
+    if "roles" in sections:
+        with timings.measure("role_discovery"):
+            m.update(role_discovery(module, conn, m, facts))
+
+    if timings.enabled:
+        m["_timings"] = {
+            "functions": timings.functions,
+            "sizes": dict((k, len(json.dumps(v, default=str))) for k, v in m.items()),
+        }
 
     return m
 
@@ -197,30 +361,198 @@ def major_version(version_num):
     return v
 
 
-def catalog_discovery(module, conn, m0):
+def server_facts(conn, sections, cache):
+    """
+    Returns a dict of facts about the server, fetched with a single query
+    that asks only for what the given sections need (and not for anything
+    that the cache can tell us instead).
+    """
+    exprs = {
+        "version": "version()",
+        "port": "current_setting('port')",
+        "data_directory": "current_setting('data_directory')",
+    }
+
+    if "settings" in sections:
+        exprs[
+            "pg_settings"
+        ] = """(SELECT json_object_agg(name, setting)
+            FROM pg_catalog.pg_settings)"""
+
+    if "system" in sections:
+        exprs["pg_backend_pid"] = "pg_backend_pid()"
+
+    if "replication" in sections:
+        exprs["pg_is_in_recovery"] = "pg_is_in_recovery()"
+        exprs[
+            "replication_settings"
+        ] = """(SELECT
+                coalesce(json_object_agg(name, setting), '{}')
+            FROM pg_catalog.pg_settings
+            WHERE name IN ('primary_conninfo', 'primary_slot_name'))"""
+
+        # pg_stat_wal_receiver is available only on 9.6+, and we can't
+        # mention it in the query at all if it doesn't exist.
+
+        catalogs = ["pg_stat_replication", "pg_replication_slots"]
+        if conn.server_version >= 90600:
+            catalogs.append("pg_stat_wal_receiver")
+
+        for cr in catalogs:
+            exprs[cr] = json_rows("SELECT * FROM pg_catalog.%s" % cr)
+
+    if "databases" in sections:
+        # We name each column, rather than selecting * and then overriding
+        # some of them, so that every row has only one value for each key.
+
+        columns = [
+            "oid",
+            "datname",
+            "datdba",
+            "pg_encoding_to_char(encoding) as encoding",
+            "datcollate",
+            "datctype",
+            "datistemplate",
+            "datallowconn",
+            "datconnlimit",
+            "datfrozenxid",
+            "datminmxid",
+            "dattablespace",
+            "datacl::text as datacl",
+        ]
+        if conn.server_version < 150000:
+            columns.append("datlastsysoid")
+
+        exprs["pg_database"] = json_rows(
+            "SELECT %s FROM pg_catalog.pg_database" % ", ".join(columns)
+        )
+
+    if "roles" in sections:
+        exprs["roles"] = json_rows(
+            """
+            SELECT *, s.setconfig as rolconfig, ARRAY(SELECT b.rolname
+                    FROM pg_catalog.pg_auth_members m
+                    JOIN pg_catalog.pg_roles b ON (m.roleid = b.oid)
+                    WHERE m.member = a.oid) as memberof
+                FROM pg_catalog.pg_authid a
+                    LEFT JOIN pg_catalog.pg_db_role_setting s
+                        ON (a.oid = s.setrole AND s.setdatabase = 0::oid)
+                WHERE rolname !~ '^pg_'
+            """
+        )
+
+    # Settings change only when the server is restarted, its configuration
+    # is reloaded, or per-role/database settings are changed. The contents
+    # of catalogs change only when rows are written to them.
+
+    fingerprints = {
+        "pg_settings": """md5(pg_postmaster_start_time()::text
+            || pg_conf_load_time()::text
+            || %s)"""
+        % catalog_fingerprint("pg_db_role_setting"),
+        "pg_database": catalog_fingerprint("pg_database"),
+        "roles": catalog_fingerprint(
+            "pg_authid", "pg_auth_members", "pg_db_role_setting"
+        ),
+    }
+
+    facts = cache.json_facts(conn, exprs, fingerprints)
+
+    if "replication" in sections:
+        oids_to_int(facts["pg_stat_replication"], ["usesysid"])
+        oids_to_int(facts["pg_replication_slots"], ["datoid"])
+    if "databases" in sections:
+        oids_to_int(
+            facts["pg_database"], ["oid", "datdba", "dattablespace", "datlastsysoid"]
+        )
+    if "roles" in sections:
+        oids_to_int(facts["roles"], ["oid", "setdatabase", "setrole"])
+
+    return facts
+
+
+def database_facts(conn, sections, cache=None, datname=None):
+    """
+    Returns a dict of facts about the database we're connected to, including
+    the results of any existence tests that determine what else we need to
+    ask about it, fetched with a single query that asks only for what the
+    given sections need (and not for anything that the cache, if given, can
+    tell us instead).
+    """
+    exprs = dict()
+
+    if "schemas" in sections:
+        exprs["schemas"] = json_rows(
+            """SELECT nspname, nspowner, nspacl::text as nspacl
+            FROM pg_catalog.pg_namespace"""
+        )
+
+    if "extensions" in sections:
+        exprs["extensions"] = json_rows("SELECT * FROM pg_catalog.pg_extension")
+
+    if "pglogical" in sections:
+        exprs[
+            "pglogical_node"
+        ] = """EXISTS (SELECT 1
+            FROM pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON (c.relnamespace=n.oid)
+            WHERE n.nspname='pglogical' AND c.relname='node')"""
+
+    if "bdr" in sections:
+        exprs[
+            "bdr_version_num"
+        ] = """EXISTS (SELECT 1
+            FROM pg_catalog.pg_proc p
+                JOIN pg_catalog.pg_namespace n ON (p.pronamespace=n.oid)
+            WHERE n.nspname='bdr' AND p.proname='bdr_version_num')"""
+
+    if "repmgr" in sections:
+        exprs[
+            "repmgr_schema"
+        ] = """(SELECT nspname
+            FROM pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON (c.relnamespace=n.oid)
+            WHERE n.nspname LIKE 'repmgr%' AND c.relname = 'nodes'
+            LIMIT 1)"""
+
+    if cache is not None:
+        fingerprints = {
+            "schemas": catalog_fingerprint("pg_namespace"),
+            "extensions": catalog_fingerprint("pg_extension"),
+        }
+        facts = cache.json_facts(conn, exprs, fingerprints, datname)
+    else:
+        facts = json_facts(conn, exprs)
+
+    if "schemas" in sections:
+        oids_to_int(facts["schemas"], ["nspowner"])
+    if "extensions" in sections:
+        oids_to_int(
+            facts["extensions"], ["oid", "extowner", "extnamespace", "extconfig"]
+        )
+
+    return facts
+
+
+def catalog_discovery(module, conn, m0, facts):
     m = dict()
 
     required_catalogs = ["pg_stat_replication", "pg_replication_slots"]
     optional_catalogs = ["pg_stat_wal_receiver"]
 
     for cr in required_catalogs:
-        m.update({cr: query_results(conn, "SELECT * FROM pg_catalog.%s" % cr)})
+        m.update({cr: facts[cr]})
 
     for cr in optional_catalogs:
-        res = []
-        if relation_exists(conn, "pg_catalog.%s" % cr):
-            res = query_results(conn, "SELECT * FROM pg_catalog.%s" % cr)
-        m.update({cr: res})
+        m.update({cr: facts.get(cr, [])})
 
     return m
 
 
-def replica_discovery(module, conn, m0):
+def replica_discovery(module, conn, m0, facts):
     m = dict()
-    cur = conn.cursor()
 
-    cur.execute("SELECT pg_is_in_recovery()")
-    if not cur.fetchone()[0]:
+    if not facts["pg_is_in_recovery"]:
         return {"role": "primary"}
 
     m.update({"recovery_settings": read_recovery_conf(m0)})
@@ -238,9 +570,10 @@ def replica_discovery(module, conn, m0):
             }
         )
 
+    settings = facts["replication_settings"]
     for k in ["primary_conninfo", "primary_slot_name"]:
-        if k not in m and (k in m["recovery_settings"] or k in m0["pg_settings"]):
-            m.update({k: m["recovery_settings"].get(k, m0["pg_settings"].get(k))})
+        if k not in m and (k in m["recovery_settings"] or k in settings):
+            m.update({k: m["recovery_settings"].get(k, settings.get(k))})
 
     if "primary_conninfo" in m:
         m.update({"primary_conninfo_parts": parse_conninfo(m["primary_conninfo"])})
@@ -252,31 +585,73 @@ def replica_discovery(module, conn, m0):
     }
 
 
-def database_discovery(module, conn, m0):
+def database_discovery(module, conn, m0, facts, pool, sections, cache):
     m = dict()
     m["databases"] = dict()
-    m["bdr_databases"] = []
+    if "bdr" in sections:
+        m["bdr_databases"] = []
 
-    dbs = query_results(
-        conn,
-        """SELECT *, pg_encoding_to_char(encoding) as encoding
-        FROM pg_catalog.pg_database""",
-    )
+    dbs = facts["pg_database"]
     for db in dbs:
-        results = dict(db)
-        datname = db["datname"]
-
-        m["databases"].update({datname: results})
+        m["databases"].update({db["datname"]: dict(db)})
+
+    # We can't connect to template0, and there's nothing to discover in the
+    # BDR supervisor database. The remaining databases are independent of
+    # each other, so we examine them in parallel if we're allowed to use
+    # more than one connection, and then collect the results in the order
+    # in which pg_database returned them.
+
+    datnames = [
+        db["datname"]
+        for db in dbs
+        if db["datname"] not in ("template0", "bdr_supervisordb")
+    ]
+
+    # We need to connect to each database only if we were asked for any
+    # sections that require it.
+
+    if not any(s in sections for s in DATABASE_SECTIONS):
+        datnames = []
+
+    def discover(datname):
+        with pool.connection(datname) as db_conn:
+            with timings.measure("database_facts"):
+                db_facts = database_facts(db_conn, sections, cache, datname)
+
+            results = dict()
+            if "schemas" in sections:
+                with timings.measure("schema_discovery"):
+                    results.update(schema_discovery(module, db_conn, m0, db_facts))
+            if "extensions" in sections:
+                with timings.measure("extension_discovery"):
+                    results.update(extension_discovery(module, db_conn, m0, db_facts))
+            if "pglogical" in sections:
+                with timings.measure("pglogical_discovery"):
+                    results.update(pglogical_discovery(module, db_conn, m0, db_facts))
+            if "bdr" in sections:
+                with timings.measure("bdr_discovery"):
+                    results.update(bdr_discovery(module, db_conn, m0, db_facts))
+            return results, db_facts
+
+    if pool.size > 1 and len(datnames) > 1:
+        workers = ThreadPool(min(pool.size, len(datnames)))
+        try:
+            discovered = workers.map(discover, datnames)
+        finally:
+            workers.terminate()
+    else:
+        discovered = [discover(datname) for datname in datnames]
 
-        if datname in ("template0", "bdr_supervisordb"):
-            continue
+    # We keep the per-database facts around for repmgr_discovery, but they
+    # are not a part of the results.
 
-        db_conn = psycopg2.connect(module.params["conninfo"] + " dbname=%s" % datname)
+    if datnames:
+        cache.forget_databases_except(datnames)
 
-        results.update(schema_discovery(module, db_conn, m0))
-        results.update(extension_discovery(module, db_conn, m0))
-        results.update(pglogical_discovery(module, db_conn, m0))
-        results.update(bdr_discovery(module, db_conn, m0))
+    facts["databases"] = dict()
+    for datname, (results, db_facts) in zip(datnames, discovered):
+        m["databases"][datname].update(results)
+        facts["databases"][datname] = db_facts
 
         if results.get("bdr", {}).get("node_group"):
             m["bdr_databases"].append(datname)
@@ -284,13 +659,11 @@ def database_discovery(module, conn, m0):
     return m
 
 
-def schema_discovery(module, conn, m0):
+def schema_discovery(module, conn, m0, facts):
     m = dict()
     m["schemas"] = dict()
 
-    schemas = query_results(
-        conn, "SELECT nspname, nspowner, nspacl FROM pg_catalog.pg_namespace"
-    )
+    schemas = facts["schemas"]
     for s in schemas:
         results = dict(s)
         nspname = s["nspname"]
@@ -300,11 +673,11 @@ def schema_discovery(module, conn, m0):
     return m
 
 
-def extension_discovery(module, conn, m0):
+def extension_discovery(module, conn, m0, facts):
     m = dict()
     m["extensions"] = dict()
 
-    extensions = query_results(conn, "SELECT * FROM pg_catalog.pg_extension")
+    extensions = facts["extensions"]
     for e in extensions:
         results = dict(e)
         extname = e["extname"]
@@ -314,10 +687,10 @@ def extension_discovery(module, conn, m0):
     return m
 
 
-def pglogical_discovery(module, conn, m0):
+def pglogical_discovery(module, conn, m0, facts):
     m = dict()
 
-    if relation_exists(conn, "pglogical.node"):
+    if facts["pglogical_node"]:
         try:
             v = query_results(
                 conn,
@@ -336,12 +709,12 @@ def pglogical_discovery(module, conn, m0):
     return {"pglogical": m} if m else {}
 
 
-def bdr_discovery(module, conn, m0):
+def bdr_discovery(module, conn, m0, facts):
     m = dict()
 
     bdr_major_version = 0
 
-    if function_exists(conn, "bdr.bdr_version_num"):
+    if facts["bdr_version_num"]:
         v = query_results(
             conn,
             """SELECT bdr.bdr_version(), bdr.bdr_version_num(),
@@ -383,49 +756,115 @@ def bdr_discovery(module, conn, m0):
     return {"bdr": m} if m else {}
 
 
-def repmgr_discovery(module, conn, m0):
+def repmgr_discovery(module, conn, m0, facts, pool):
     m = dict()
 
     repmgr_conf = read_repmgr_conf(m0)
     if repmgr_conf is not None:
         m["repmgr_conf"] = repmgr_conf
 
-    if "repmgr" in m0["databases"]:
-        repmgr_conn = psycopg2.connect(module.params["conninfo"] + " dbname=repmgr")
+    # database_discovery will have looked for the repmgr schema already if
+    # it needed to connect to the repmgr database anyway, but otherwise we
+    # must look for it ourselves.
 
-        repmgr_schema = repmgr_schema_name(repmgr_conn)
-        if repmgr_schema is not None:
-            m["repmgr_schema"] = repmgr_schema
-            m["nodes"] = query_results(
-                repmgr_conn, 'SELECT * FROM "%s".nodes' % repmgr_schema
-            )
+    if "repmgr" in m0["databases"]:
+        with pool.connection("repmgr") as repmgr_conn:
+            db_facts = facts["databases"].get("repmgr")
+            if db_facts is None:
+                db_facts = database_facts(repmgr_conn, ["repmgr"])
+
+            repmgr_schema = db_facts["repmgr_schema"]
+            if repmgr_schema is not None:
+                m["repmgr_schema"] = repmgr_schema
+                m["nodes"] = query_results(
+                    repmgr_conn, 'SELECT * FROM "%s".nodes' % repmgr_schema
+                )
 
     return {"repmgr": m} if m else {}
 
 
-def role_discovery(module, conn, m0):
+def role_discovery(module, conn, m0, facts):
     m = dict()
     m["roles"] = dict()
 
-    roles = query_results(
-        conn,
-        """
-        SELECT *, s.setconfig as rolconfig, ARRAY(SELECT b.rolname
-                FROM pg_catalog.pg_auth_members m
-                JOIN pg_catalog.pg_roles b ON (m.roleid = b.oid)
-                WHERE m.member = a.oid) as memberof
-            FROM pg_catalog.pg_authid a
-                LEFT JOIN pg_catalog.pg_db_role_setting s
-                    ON (a.oid = s.setrole AND s.setdatabase = 0::oid)
-            WHERE rolname !~ '^pg_'
-        """,
-    )
+    roles = facts["roles"]
     for r in roles:
         m["roles"].update({r["rolname"]: r})
 
     return m
 
 
+class ConnectionPool(object):
+    """
+    Hands out connections to individual databases on the server, keeping no
+    more than `size` of them open at once. A connection that is released in
+    good order stays open, and is reused by the next request for the same
+    database; idle connections are closed to make room for new ones when
+    the pool is full. The caller must close() the pool when done with it.
+    """
+
+    def __init__(self, conninfo, size=1):
+        self.conninfo = conninfo
+        self.size = max(1, size)
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.lock = threading.Lock()
+        self.idle = collections.OrderedDict()
+        self.in_use = 0
+
+    @contextlib.contextmanager
+    def connection(self, datname):
+        self.slots.acquire()
+        try:
+            conn = self._checkout(datname)
+            try:
+                yield conn
+            except Exception:
+                conn.close()
+                raise
+            else:
+                self._checkin(datname, conn)
+        finally:
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    def _checkout(self, datname):
+        with self.lock:
+            self.in_use += 1
+            conn = self.idle.pop(datname, None)
+            if conn is not None and conn.closed:
+                conn = None
+            while (
+                conn is None and self.idle and self.in_use + len(self.idle) > self.size
+            ):
+                self.idle.popitem(last=False)[1].close()
+
+        if conn is None:
+            with timings.measure("connect"):
+                conn = psycopg2.connect(self.conninfo + " dbname=%s" % datname)
+
+        return conn
+
+    def _checkin(self, datname, conn):
+        if conn.closed:
+            return
+
+        # End any transaction the caller left open, so that the connection is
+        # not left idle in transaction while it waits to be reused.
+        conn.rollback()
+
+        with self.lock:
+            previous = self.idle.pop(datname, None)
+            self.idle[datname] = conn
+        if previous is not None:
+            previous.close()
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                self.idle.popitem(last=False)[1].close()
+
+
 def parse_kv(str):
     parts = [x.strip() for x in str.split("=", 1)]
 
@@ -481,51 +920,196 @@ def read_repmgr_conf(m0):
     return m
 
 
-def relation_exists(conn, relname):
-    nspname = "public"
-    if "." in relname:
-        (nspname, relname) = relname.split(".", 1)
+def json_rows(query):
+    """
+    Returns an SQL expression that evaluates to a JSON array of the rows
+    returned by the given query, each represented as an object.
+    """
+    return "(SELECT coalesce(json_agg(q), '[]') FROM (%s) q)" % query
+
+
+def json_facts(conn, exprs, values=None):
+    """
+    Takes a dict that maps names to SQL expressions, and returns a dict that
+    maps the same names to the values of those expressions, by evaluating
+    all of them on the server in a single query that returns a JSON object.
+
+    If given, values maps aliases to SQL expressions that are each evaluated
+    only once, and which the expressions in exprs may refer to as alias.value
+    (any number of times).
+    """
+    query = "SELECT json_build_object(%s)" % ", ".join(
+        "'%s', %s" % (k, v) for k, v in exprs.items()
+    )
+    if values:
+        # OFFSET 0 stops the planner from pulling each subquery up into the
+        # outer query, where it would evaluate the expression at every use.
+        query += " FROM " + ", ".join(
+            "(SELECT %s AS value OFFSET 0) %s" % (v, k) for k, v in values.items()
+        )
 
     cur = conn.cursor()
-    cur.execute(
-        """SELECT relname
-        FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON (c.relnamespace=n.oid)
-        WHERE n.nspname=%s AND c.relname=%s""",
-        (nspname, relname),
+    cur.execute(query)
+    facts = cur.fetchone()[0]
+
+    # We count each row that the server aggregated into an array (or object)
+    # for us as if we had fetched it ourselves.
+    timings.count(
+        queries=1,
+        rows=sum(len(v) for v in facts.values() if isinstance(v, (list, dict))),
     )
 
-    return cur.rowcount > 0
+    return facts
+
+
+def catalog_fingerprint(*catalogs):
+    """
+    Returns an SQL expression that evaluates to a digest that changes when
+    any row in the given catalogs is inserted, updated, or deleted, or when
+    any of them is rewritten.
+    """
+    return "md5(%s)" % " || '/' || ".join(
+        """(SELECT pg_relation_filenode('pg_catalog.%s')::text || ':'
+            || coalesce(string_agg(xmin::text || ctid::text, ',' ORDER BY ctid), '')
+            FROM pg_catalog.%s)"""
+        % (c, c)
+        for c in catalogs
+    )
 
 
-def function_exists(conn, proname):
-    nspname = "public"
-    if "." in proname:
-        (nspname, proname) = proname.split(".", 1)
+class FactsCache(object):
+    """
+    Remembers facts fetched by json_facts() from one run to the next, along
+    with fingerprints that tell us whether they are still accurate. Facts
+    about the server are remembered separately from facts about each of its
+    databases. If no path is given, nothing is remembered.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.scopes = dict()
+
+        if path:
+            try:
+                with io.open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("format") == self.FORMAT and isinstance(
+                    data.get("scopes"), dict
+                ):
+                    self.scopes = data["scopes"]
+            except (IOError, OSError, ValueError, KeyError, AttributeError):
+                pass
+
+    def json_facts(self, conn, exprs, fingerprints, datname=None):
+        """
+        Like json_facts(), but for each name in exprs that has a fingerprint
+        expression in fingerprints, tells the server to evaluate it only if
+        the fingerprint doesn't match what we remember, and otherwise uses
+        the remembered value. If datname is given, the facts are about that
+        database rather than the server.
+        """
+        if not self.path:
+            return json_facts(conn, exprs)
+
+        scope = "server"
+        if datname is not None:
+            scope = "database:%s" % datname
+
+        with self.lock:
+            remembered = dict(self.scopes.get(scope) or {})
+
+        # We evaluate each fingerprint only once, and refer to its value both
+        # in the result and in the condition under which we evaluate the
+        # expression that it guards.
+        exprs = dict(exprs)
+        fingerprints = dict((k, v) for k, v in fingerprints.items() if k in exprs)
+        for name in fingerprints:
+            fingerprint = "%s_fingerprint.value" % name
+            exprs["%s_fingerprint" % name] = fingerprint
+
+            entry = remembered.get(name)
+            if not (isinstance(entry, dict) and "value" in entry):
+                remembered.pop(name, None)
+                continue
+
+            # We interpolate only digests that we computed ourselves.
+            old = entry.get("fingerprint") or ""
+            if re.match("^[0-9a-f]{32}$", old):
+                exprs[name] = "CASE WHEN %s = '%s' THEN NULL ELSE %s END" % (
+                    fingerprint,
+                    old,
+                    exprs[name],
+                )
+
+        facts = json_facts(
+            conn,
+            exprs,
+            dict(("%s_fingerprint" % k, v) for k, v in fingerprints.items()),
+        )
 
-    cur = conn.cursor()
-    cur.execute(
-        """SELECT proname
-        FROM pg_catalog.pg_proc p JOIN pg_catalog.pg_namespace n ON (p.pronamespace=n.oid)
-        WHERE n.nspname=%s AND p.proname=%s""",
-        (nspname, proname),
-    )
+        for name in fingerprints:
+            fingerprint = facts.pop("%s_fingerprint" % name)
+            if (
+                name in remembered
+                and remembered[name].get("fingerprint") == fingerprint
+            ):
+                facts[name] = remembered[name]["value"]
+            else:
+                remembered[name] = {"fingerprint": fingerprint, "value": facts[name]}
 
-    return cur.rowcount > 0
+        with self.lock:
+            self.scopes[scope] = remembered
 
+        return facts
 
-def repmgr_schema_name(conn):
-    cur = conn.cursor()
-    cur.execute(
-        """SELECT nspname
-        FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON (c.relnamespace=n.oid)
-        WHERE n.nspname LIKE 'repmgr%' AND c.relname = 'nodes'"""
-    )
+    def forget_databases_except(self, datnames):
+        """
+        Forgets everything we remember about databases other than the ones
+        given (e.g., because they have been dropped).
+        """
+        keep = set("database:%s" % datname for datname in datnames)
+        with self.lock:
+            for scope in list(self.scopes):
+                if scope.startswith("database:") and scope not in keep:
+                    del self.scopes[scope]
 
-    repmgr_schema = None
-    if cur.rowcount:
-        repmgr_schema = cur.fetchone()[0]
+    def save(self):
+        """
+        Writes what we remember to the file atomically, so that concurrent or
+        interrupted runs never leave a partially-written file behind.
+        """
+        if not self.path:
+            return
 
-    return repmgr_schema
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)),
+            prefix=".%s." % os.path.basename(self.path),
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"format": self.FORMAT, "scopes": self.scopes}, f)
+            os.rename(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+
+def oids_to_int(rows, columns):
+    """
+    Converts the given oid (or oid[]) columns in each of the given rows to
+    ints in place. JSON represents oids as strings, but psycopg2 returns them
+    as ints, and we want our results to look the same either way.
+    """
+    for row in rows:
+        for c in columns:
+            v = row.get(c)
+            if isinstance(v, list):
+                row[c] = [int(x) for x in v]
+            elif v is not None:
+                row[c] = int(v)
 
 
 def query_results(conn, query):
@@ -535,9 +1119,61 @@ def query_results(conn, query):
     column_names = [desc[0] for desc in cur.description]
     for row in cur:
         res.append(dict(list(zip(column_names, row))))
+    timings.count(queries=1, rows=len(res))
     return res
 
 
+class Timings(object):
+    """
+    Records the number of calls to each discovery function, the total time
+    they took, and the number of queries executed and rows fetched by them.
+    Measurements may be nested, and queries are attributed to the innermost
+    function being measured in the thread that executes them. Does nothing
+    unless enabled.
+    """
+
+    # time.monotonic() is not available on Python 2.
+    clock = getattr(time, "monotonic", time.time)
+
+    def __init__(self):
+        self.enabled = False
+        self.functions = dict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        parent = getattr(self.local, "current", None)
+        self.local.current = current = {"queries": 0, "rows": 0}
+        start = self.clock()
+        try:
+            yield
+        finally:
+            duration = self.clock() - start
+            self.local.current = parent
+            with self.lock:
+                f = self.functions.setdefault(
+                    name, {"calls": 0, "duration": 0.0, "queries": 0, "rows": 0}
+                )
+                f["calls"] += 1
+                f["duration"] = round(f["duration"] + duration, 6)
+                f["queries"] += current["queries"]
+                f["rows"] += current["rows"]
+
+    def count(self, queries=0, rows=0):
+        current = getattr(self.local, "current", None)
+        if current is not None:
+            current["queries"] += queries
+            current["rows"] += rows
+
+
+timings = Timings()
+
+
 def cast_interval(value, cur):
     if value is None:
         return None
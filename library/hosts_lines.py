@@ -25,11 +25,19 @@ options:
   path:
     description:
       - The path to an existing file
-    required: true
+    required: false
   lines:
     description:
       - An array of hosts entries that must exist in the file
-    required: true
+    required: false
+  files:
+    description:
+      - A list of dicts, each with a path and a list of lines, to process as
+        though each had been specified as path and lines in a separate
+        invocation. You must specify either path and lines, or files.
+    required: false
+notes:
+  - The diff is computed only in --diff mode.
 author: "Abhijit Menon-Sen <ams@2ndQuadrant.com>"
 """
 
@@ -39,6 +47,14 @@ EXAMPLES = """
     lines:
     - 127.0.0.1 localhost
     - 192.0.2.1 example.com
+- hosts_lines:
+    files:
+    - path: /etc/hosts
+      lines:
+      - 192.0.2.1 example.com
+    - path: /etc/cloud/templates/hosts.debian.tmpl
+      lines:
+      - 192.0.2.1 example.com
 """
 
 import traceback
@@ -50,36 +66,55 @@ from ansible.module_utils._text import to_bytes, to_native
 
 
 def hosts_lines(module):
-    m = {}
+    files = module.params.get("files")
+    if not files:
+        return file_lines(module, module.params.get("path"), module.params.get("lines"))
+
+    m = {"changed": False, "files": []}
+    diffs = []
+
+    for entry in files:
+        if not isinstance(entry, dict) or "path" not in entry or "lines" not in entry:
+            module.fail_json(msg="each entry in files must have a path and lines")
+
+        path = os.path.expanduser(os.path.expandvars(entry["path"]))
+        r = file_lines(module, path, entry["lines"])
+        if "diff" in r:
+            diffs.append(r.pop("diff")[0])
+        r["path"] = path
+
+        m["files"].append(r)
+        m["changed"] = m["changed"] or r["changed"]
+
+    if diffs:
+        m["diff"] = diffs
+
+    return m
+
 
-    path = module.params.get("path")
-    diff = {
-        "before": "",
-        "after": "",
-        "before_header": "%s (content)" % path,
-        "after_header": "%s (content)" % path,
-    }
+def file_lines(module, path, lines):
+    m = {}
 
     # Given a list of lines that may include comments, blank lines (which don't
     # do anything useful), and valid hosts entries comprising an IP address and
-    # one or more hostnames separated by spaces. We build up the sets of lines,
-    # addresses, and hostnames that we need to check existing hosts entries to
-    # see if they need to be replaced.
-
-    lines = set()
-    to_replace = set()
+    # one or more hostnames separated by spaces. We build an index of the lines
+    # (in order) and the set of addresses and hostnames that we need to check
+    # existing hosts entries against to see if they need to be replaced.
 
-    for l in module.params.get("lines"):
-        lines.add(l)
+    wanted = {}
+    for l in lines:
+        wanted.setdefault(l, len(wanted))
 
+    to_replace = set()
+    for l in wanted:
         if not l.lstrip().startswith("#"):
-            words = l.split()
-            for n in words:
-                to_replace.add(n)
+            to_replace.update(l.split())
 
+    present = set()
     before_lines = []
     after_lines = []
-    changes = []
+    appended = []
+    skipped = False
 
     try:
         b_path = to_bytes(path, errors="surrogate_or_strict")
@@ -94,58 +129,62 @@ def hosts_lines(module):
             # an address or name that overlaps with an entry we are adding, we
             # skip it. Otherwise we copy it over unmodified.
 
-            if l in lines:
-                lines.remove(l)
+            if l in wanted and l not in present:
+                present.add(l)
 
             elif not l.lstrip().startswith("#"):
-                words = l.split()
-                if set(words) & to_replace:
-                    changes.append("skip")
+                if not to_replace.isdisjoint(l.split()):
+                    skipped = True
                     continue
 
             after_lines.append(line)
 
-        if lines:
-            changes.append("append")
-            for l in lines:
-                after_lines.append(l + "\n")
+        missing = [l for l in sorted(wanted, key=wanted.get) if l not in present]
+
+        # We must not append a line to the end of an unterminated last line.
+        appended = [l + "\n" for l in missing]
+        if appended and after_lines and not after_lines[-1].endswith("\n"):
+            appended.insert(0, "\n")
 
         # If we didn't need to skip any existing lines, we can just append the
         # new lines to /etc/hosts. Otherwise we must replace the file, which we
         # prefer to do by writing to a temporary file and using atomic_move; but
         # that doesn't work on Docker containers, so we must overwrite in-place.
 
-        if changes and not module.check_mode:
-            contents = to_bytes("".join(after_lines))
-
-            if "skip" in changes and module.params["platform"] == "docker":
+        if (skipped or missing) and not module.check_mode:
+            if skipped and module.params.get("platform") == "docker":
                 m["operation"] = "overwrite"
                 with open(b_path, "wb") as f:
-                    f.write(contents)
+                    f.write(to_bytes("".join(after_lines + appended)))
 
-            elif "skip" in changes:
+            elif skipped:
                 m["operation"] = "replace"
                 tmpfd, tmpfile = tempfile.mkstemp()
                 with os.fdopen(tmpfd, "wb") as f:
-                    f.write(contents)
+                    f.write(to_bytes("".join(after_lines + appended)))
                 module.atomic_move(
                     tmpfile,
                     to_native(b_path),
-                    unsafe_writes=module.params["unsafe_writes"],
+                    unsafe_writes=module.params.get("unsafe_writes"),
                 )
 
             else:
                 m["operation"] = "append"
-                contents = to_bytes("".join(map(lambda l: l + "\n", lines)))
                 with open(b_path, "ab") as f:
-                    f.write(contents)
+                    f.write(to_bytes("".join(appended)))
     except Exception as e:
         module.fail_json(msg=str(e), exception=traceback.format_exc())
 
-    diff["before"] = "".join(before_lines)
-    diff["after"] = "".join(after_lines)
-    m["diff"] = [diff, []]
-    m["changed"] = bool(changes)
+    if module._diff:
+        diff = {
+            "before": "".join(before_lines),
+            "after": "".join(after_lines + appended),
+            "before_header": "%s (content)" % path,
+            "after_header": "%s (content)" % path,
+        }
+        m["diff"] = [diff, []]
+
+    m["changed"] = bool(skipped or appended)
 
     return m
 
@@ -153,11 +192,15 @@ def hosts_lines(module):
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            path=dict(type="path", required=True),
-            lines=dict(type="list", required=True),
+            path=dict(type="path"),
+            lines=dict(type="list"),
+            files=dict(type="list"),
             unsafe_writes=dict(type="bool"),
             platform=dict(type="str"),
         ),
+        required_one_of=[["path", "files"]],
+        mutually_exclusive=[["path", "files"], ["lines", "files"]],
+        required_together=[["path", "lines"]],
         supports_check_mode=True,
     )
 
@@ -24,11 +24,19 @@ options:
   path:
     description:
       - The path to an existing file
-    required: true
+    required: false
   lines:
     description:
       - An array of lines that must exist in the file
-    required: true
+    required: false
+  files:
+    description:
+      - A list of dicts, each with a path and a list of lines, to process as
+        though each had been specified as path and lines in a separate
+        invocation. You must specify either path and lines, or files.
+    required: false
+notes:
+  - The diff is computed only in --diff mode.
 author: "Abhijit Menon-Sen <ams@2ndQuadrant.com>"
 """
 
@@ -38,52 +46,97 @@ EXAMPLES = """
     lines:
     - 127.0.0.1 localhost
     - 192.0.2.1 example.com
+- linesinfile:
+    files:
+    - path: /etc/sysctl.conf
+      lines:
+      - vm.swappiness=1
+    - path: /etc/ssh/ssh_known_hosts
+      lines: "{{ known_hosts_lines }}"
 """
 
+import os
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
 
 
 def linesinfile(module):
+    files = module.params.get("files")
+    if not files:
+        return file_lines(module, module.params.get("path"), module.params.get("lines"))
+
+    m = {"changed": False, "files": []}
+    diffs = []
+
+    for entry in files:
+        if not isinstance(entry, dict) or "path" not in entry or "lines" not in entry:
+            module.fail_json(msg="each entry in files must have a path and lines")
+
+        path = os.path.expanduser(os.path.expandvars(entry["path"]))
+        r = file_lines(module, path, entry["lines"])
+        if "diff" in r:
+            diffs.append(r.pop("diff")[0])
+        r["path"] = path
+
+        m["files"].append(r)
+        m["changed"] = m["changed"] or r["changed"]
+
+    if diffs:
+        m["diff"] = diffs
+
+    return m
+
+
+def file_lines(module, path, lines):
     m = {}
 
-    path = module.params.get("path")
-    diff = {
-        "before": "",
-        "after": "",
-        "before_header": "%s (content)" % path,
-        "after_header": "%s (content)" % path,
-    }
+    # We read the file line by line, removing each line we find from the set
+    # of lines we want (which we keep in order), and keep the contents only
+    # if we need them for --diff.
+
+    wanted = {}
+    for l in lines:
+        wanted.setdefault(l, len(wanted))
 
-    lines = {}
     b_lines = []
-    a_lines = []
-    for l in module.params.get("lines"):
-        lines[l] = 1
+    last_line = ""
+    appended = []
 
     try:
         with open(path, "a+") as f:
             f.seek(0)
             for line in f:
-                b_lines.append(line)
-                a_lines.append(line)
+                if module._diff:
+                    b_lines.append(line)
+                last_line = line
                 line = line.rstrip("\r\n")
-                if line in lines:
-                    del lines[line]
-
-            if lines:
-                m["changed"] = True
-                for l in lines:
-                    if not module.check_mode:
-                        f.write(l + "\n")
-                    a_lines.append(l + "\n")
+                if line in wanted:
+                    del wanted[line]
+
+            if wanted:
+                appended = [l + "\n" for l in sorted(wanted, key=wanted.get)]
+
+                # We must not append a line to the end of an unterminated last
+                # line.
+                if last_line and not last_line.endswith("\n"):
+                    appended.insert(0, "\n")
+
+                if not module.check_mode:
+                    f.write("".join(appended))
     except Exception as e:
         module.fail_json(msg=str(e), exception=traceback.format_exc())
 
-    diff["before"] = "".join(b_lines)
-    diff["after"] = "".join(a_lines)
-    m["diff"] = [diff, []]
+    m["changed"] = bool(appended)
+
+    if module._diff:
+        diff = {
+            "before": "".join(b_lines),
+            "after": "".join(b_lines + appended),
+            "before_header": "%s (content)" % path,
+            "after_header": "%s (content)" % path,
+        }
+        m["diff"] = [diff, []]
 
     return m
 
@@ -91,9 +144,13 @@ def linesinfile(module):
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            path=dict(type="path", required=True),
-            lines=dict(type="list", required=True),
+            path=dict(type="path"),
+            lines=dict(type="list"),
+            files=dict(type="list"),
         ),
+        required_one_of=[["path", "files"]],
+        mutually_exclusive=[["path", "files"], ["lines", "files"]],
+        required_together=[["path", "lines"]],
         supports_check_mode=True,
     )
 
@@ -27,6 +27,8 @@ options:
         a string (i.e., the query text) or a dict with the query 'text' and
         either a list of 'args' to bind to %s placeholders in the query, or a
         dict of 'named_args' to bind to %(name)s placeholders in the query.
+        The dict may also specify 'statement_timeout', 'lock_timeout', or
+        'explain' to override the module-level setting for that query.
         All of the queries are executed in the same transaction.
         You must specify exactly one of 'query' or 'queries'.
     required: true
@@ -42,6 +44,82 @@ options:
         For such statements autocommit should be set to 'yes'.
     required: false
     default: 'no'
+  batch:
+    description:
+      - If set, all of the queries are sent to the server together in a
+        single round-trip instead of one by one, which is much faster when
+        there are many of them. The rowcount and runtime of each query are
+        still reported separately, and if any query fails, the error says
+        which one. The results of queries that return rows are discarded.
+        The rowcounts, and whether the module reports a change, are the same
+        as without batch (e.g., -1 for a utility statement like CREATE).
+      - Queries that cannot be executed inside a transaction block (or a
+        PL/pgSQL function) cannot be sent in a batch, so this option cannot
+        be combined with autocommit.
+    required: false
+    default: 'no'
+  fetch_size:
+    description:
+      - If set, each query is executed through a server-side cursor, and its
+        results are fetched this many rows at a time instead of all at once.
+        Every query must then return rows (e.g., SELECT).
+    required: false
+  max_rows:
+    description:
+      - If set, no more than this many rows are fetched from each query. A
+        list of booleans named C(truncated) shows which queries had more.
+    required: false
+  spool:
+    description:
+      - The path to a file on the target to which result rows are written as
+        gzip-compressed JSON Lines, instead of being returned in C(results).
+        Each line is an object with the index of the query and the row, e.g.,
+        C({"query": 0, "row": {"a": 42}}), with the name of the database
+        added as C(database) if C(databases) is set. The module returns the
+        path as C(spool) and the number of rows written for each query as
+        C(spooled_rows). The file is created with mode 0600.
+      - In check mode, the rows are counted, but the file is not written.
+    required: false
+  databases:
+    description:
+      - A list of databases in which to execute the queries, or C(all) to
+        execute them in every database that accepts connections (except
+        template databases). The conninfo is used to connect to each
+        database with its dbname replaced. Each database has its own
+        connection and transaction, and the transactions are committed
+        only if the queries succeed in every database. The results are
+        returned as dicts keyed by database name.
+    required: false
+  statement_timeout:
+    description:
+      - If set, each query is cancelled if it takes longer than this (e.g.,
+        C(30s), C(5min), or a number of milliseconds). The server's setting
+        is restored after each query. With batch, the timeout applies to the
+        whole batch.
+    required: false
+  lock_timeout:
+    description:
+      - If set, each query is cancelled if it waits longer than this for any
+        lock (e.g., C(10s)), so that a DDL statement queued behind a long
+        transaction does not block every other query on the table in turn.
+        The server's setting is restored after each query.
+    required: false
+  explain:
+    description:
+      - If set to C(plan), the plan for each query is obtained with EXPLAIN
+        (FORMAT JSON) before the query is executed as usual. If set to
+        C(analyze), each query is executed with EXPLAIN (ANALYZE, BUFFERS,
+        FORMAT JSON) instead, and its result rows are not returned (but any
+        changes it makes are committed, as usual). The plans are returned as
+        C(plans). Only statements that EXPLAIN accepts can be explained.
+    required: false
+    choices: [analyze, plan]
+  workers:
+    description:
+      - The number of databases in which to execute the queries in parallel,
+        each over its own connection, if C(databases) is set.
+    required: false
+    default: 4
 notes:
    - This module requires the I(psycopg2) Python library to be installed.
    - This module can execute any sort of query, but you may need to cast some
@@ -75,11 +153,50 @@ EXAMPLES = """
 - debug: msg="also {{ query.rowcount }} rows"
   when:
     query.rowcounts|length == 1
+- postgresql_query:
+    batch: yes
+    queries:
+      - CREATE ROLE app LOGIN
+      - GRANT CONNECT ON DATABASE app TO app
+      - text: UPDATE x SET b = %s WHERE a = 42
+        args:
+          - bar
+  register: batch
+- debug: msg="{{ batch.rowcounts[2] }} rows updated"
+- postgresql_query:
+    query: SELECT * FROM bdr.node_slots
+    fetch_size: 1000
+    max_rows: 100000
+    spool: /tmp/node_slots.jsonl.gz
+  register: slots
+- debug: msg="{{ slots.spooled_rows[0] }} rows written to {{ slots.spool }}"
+- postgresql_query:
+    conninfo: "{{ dsn }}"
+    query: ALTER EXTENSION pglogical UPDATE
+    databases: all
+  register: updates
+- postgresql_query:
+    conninfo: "{{ dsn }}"
+    query: SELECT count(*) FROM bdr.bdr_nodes
+    databases: [bdrdb, appdb]
+  register: nodes
+- debug: msg="{{ nodes.results.bdrdb[0].count }} nodes in bdrdb"
+- postgresql_query:
+    conninfo: "{{ dsn }}"
+    queries:
+      - text: ALTER TABLE t ADD COLUMN c int
+        lock_timeout: 5s
+      - text: UPDATE t SET c = 0 WHERE c IS NULL
+        explain: analyze
+    statement_timeout: 10min
+  register: altered
+- debug: msg="{{ altered.plans[1][0]['Execution Time'] }}ms"
 """
 
 RETURN = """
 rowcounts:
-    description: An array of rowcounts from each query executed.
+    description: An array of rowcounts from each query executed. With
+    fetch_size, this is the number of rows fetched from each query.
     type: list
     sample: [
         1,
@@ -103,6 +220,46 @@ results:
             "b": 31
         }
     ]
+truncated:
+    description: An array of booleans, one for each query, showing whether
+    it returned more than max_rows rows.
+    returned: if max_rows is set
+    type: list
+    sample: [false, true]
+spool:
+    description: The path of the file that result rows were written to.
+    returned: if spool is set
+    type: str
+    sample: /tmp/node_slots.jsonl.gz
+spooled_rows:
+    description: The number of rows written to the spool file from each query.
+    returned: if spool is set
+    type: list
+    sample: [1000, 0]
+plans:
+    description: An array with the plan (as parsed from EXPLAIN's JSON output)
+    for each query that was explained, or null for those that were not.
+    returned: if explain is set for any query
+    type: list
+    sample: [[{"Plan": {"Node Type": "Result", "Actual Rows": 1}}]]
+plan:
+    description: If only one query was executed, the plan is set separately
+    (in addition to the 'plans' array).
+    returned: if explain is set
+    type: list
+databases:
+    description: The names of the databases in which the queries were
+    executed. If this is set, then results, rowcounts, runtimes, etc. are
+    dicts keyed by database name, with the value for each database being
+    what would otherwise have been returned by itself.
+    returned: if databases is set
+    type: list
+    sample: [bdrdb, appdb]
+failed_database:
+    description: The name of the database in which a query failed.
+    returned: failure, if databases is set
+    type: str
+    sample: bdrdb
 runtimes:
     description: An array of runtimes (in seconds) from each query executed.
     type: list
@@ -121,18 +278,31 @@ runtime:
 from ansible.module_utils.six import string_types
 from ansible.module_utils.basic import AnsibleModule
 
+import gzip
+import json
+import os
+import random
+import re
+import threading
 import traceback
 import time
+from multiprocessing.pool import ThreadPool
 
 try:
     import psycopg2
     import psycopg2.extras
-    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, make_dsn
 except ImportError:
     psycopg2_found = False
 else:
     psycopg2_found = True
 
+# time.perf_counter() is a monotonic, high-resolution clock that is not
+# affected by changes to the system time, but is not available on Python 2.
+clock = getattr(time, "perf_counter", time.time)
+
+TIMEOUTS = ["statement_timeout", "lock_timeout"]
+
 
 def get_queries(module):
     """
@@ -196,6 +366,455 @@ def get_query(q):
     return text, args
 
 
+def get_query_settings(q, params):
+    """
+    Returns a dict of the timeouts to set while executing the given entry
+    from 'queries', and the kind of EXPLAIN (if any) to perform, taking the
+    module-level settings from params unless the entry overrides them.
+    """
+    timeouts = dict()
+    for name in TIMEOUTS:
+        value = params[name]
+        if isinstance(q, dict) and name in q:
+            value = q[name]
+        if value is not None and value != "":
+            timeouts[name] = str(value)
+
+    explain = params["explain"]
+    if isinstance(q, dict) and "explain" in q:
+        explain = q["explain"] or None
+    if explain not in (None, "analyze", "plan"):
+        raise ValueError("explain must be one of: analyze, plan (not %s)" % explain)
+
+    return timeouts, explain
+
+
+def set_timeouts(cur, timeouts):
+    """
+    Sets the given timeouts for the session (because SET LOCAL would have no
+    effect in autocommit mode).
+    """
+    if timeouts:
+        names = sorted(timeouts)
+        cur.execute(
+            "SELECT %s" % ", ".join("set_config(%s, %s, false)" for n in names),
+            [v for n in names for v in (n, timeouts[n])],
+        )
+
+
+def reset_timeouts(cur, timeouts):
+    """
+    Restores the server's setting for each of the given timeouts.
+    """
+    if timeouts:
+        cur.execute(";".join("RESET %s" % name for name in sorted(timeouts)))
+
+
+def explain_query(cur, text, args, analyze=False):
+    """
+    Executes EXPLAIN (FORMAT JSON) for the given query, with ANALYZE (which
+    executes the query) if specified, and returns the plan.
+    """
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    cur.execute("EXPLAIN (%s) %s" % (options, text), args)
+    plan = cur.fetchone()[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return plan
+
+
+class BatchError(Exception):
+    """
+    Raised by execute_batch() to report the index of the query in the batch
+    that failed, along with the underlying error.
+    """
+
+    def __init__(self, index, error):
+        super(BatchError, self).__init__(str(error))
+        self.index = index
+        self.error = error
+
+
+def statement_kind(text):
+    """
+    Returns "rows" if the given statement returns rows (like SELECT, or DML
+    with RETURNING), "dml" if it is an INSERT, UPDATE, DELETE, or MERGE that
+    does not, or "utility" for any other statement (e.g., CREATE or GRANT).
+    A statement that begins with WITH is treated as DML if it contains any
+    of those keywords.
+    """
+    text = re.sub(r"(?s)^(\s|\(|--[^\n]*|/\*.*?\*/)*", "", text)
+    word = re.match(r"\w*", text).group(0).upper()
+    dml = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.I)
+
+    if word in ("INSERT", "UPDATE", "DELETE", "MERGE") or (
+        word == "WITH" and dml.search(text)
+    ):
+        if re.search(r"\bRETURNING\b", text, re.I):
+            return "rows"
+        return "dml"
+    if word in ("SELECT", "WITH", "VALUES", "TABLE", "SHOW", "EXPLAIN"):
+        return "rows"
+    return "utility"
+
+
+def execute_batch(conn, queries):
+    """
+    Executes the given queries on the connection in a single round-trip, and
+    returns (rowcounts, runtimes) with one entry for each query. Raises
+    BatchError if any query fails (in which case the transaction must be
+    rolled back).
+
+    We interpolate the arguments for each query on the client side, and wrap
+    the resulting statements in a DO block that EXECUTEs each one in turn,
+    recording its rowcount and runtime in a transaction-local setting that
+    we read back at the end. If a statement fails, the DO block re-raises
+    the error with a hint that identifies the statement.
+    """
+    cur = conn.cursor()
+    encoding = psycopg2.extensions.encodings[conn.encoding]
+
+    statements = []
+    for q in queries:
+        text, args = get_query(q)
+        stmt = cur.mogrify(text, args)
+        if not isinstance(stmt, str):
+            stmt = stmt.decode(encoding)
+        literal = cur.mogrify("%s", [stmt])
+        if not isinstance(literal, str):
+            literal = literal.decode(encoding)
+        statements.append(literal)
+
+    # The dollar-quote tag must not occur anywhere inside the block.
+    tag = "$batch$"
+    while any(tag in stmt for stmt in statements):
+        tag = "$batch_%d$" % random.randint(0, 1 << 30)
+
+    body = "\n".join(
+        """
+        i := %d;
+        t := clock_timestamp();
+        EXECUTE %s;
+        GET DIAGNOSTICS n = ROW_COUNT;
+        rowcounts := rowcounts || n;
+        runtimes := runtimes || extract(epoch from clock_timestamp() - t);"""
+        % (i, stmt)
+        for i, stmt in enumerate(statements)
+    )
+
+    sql = """
+        DO %(tag)s
+        DECLARE
+            i int;
+            n bigint;
+            t timestamptz;
+            detail text;
+            rowcounts bigint[] := '{}';
+            runtimes float8[] := '{}';
+        BEGIN
+            %(body)s
+            PERFORM set_config('tpa.batch', json_build_object(
+                'rowcounts', rowcounts, 'runtimes', runtimes)::text, true);
+        EXCEPTION WHEN OTHERS THEN
+            GET STACKED DIAGNOSTICS detail = PG_EXCEPTION_DETAIL;
+            IF detail <> '' THEN
+                RAISE EXCEPTION USING ERRCODE = SQLSTATE, MESSAGE = SQLERRM,
+                    DETAIL = detail, HINT = 'batch query ' || i;
+            END IF;
+            RAISE EXCEPTION USING ERRCODE = SQLSTATE, MESSAGE = SQLERRM,
+                HINT = 'batch query ' || i;
+        END
+        %(tag)s;
+        SELECT current_setting('tpa.batch')
+        """ % {
+        "tag": tag,
+        "body": body,
+    }
+
+    try:
+        cur.execute(sql)
+    except psycopg2.Error as e:
+        hint = re.match(r"batch query (\d+)$", e.diag.message_hint or "")
+        if hint:
+            raise BatchError(int(hint.group(1)), e)
+        raise
+
+    batch = json.loads(cur.fetchone()[0])
+    cur.close()
+
+    return batch["rowcounts"], batch["runtimes"]
+
+
+def stream_rows(cur, fetch_size=None):
+    """
+    Yields each row of results from the cursor as a dict, fetching fetch_size
+    rows at a time if specified (as we must for a named cursor), or else just
+    iterating over the cursor. Yields nothing if the query returned no rows.
+    """
+    if not fetch_size:
+        if cur.description is not None:
+            column_names = [desc[0] for desc in cur.description]
+            for row in cur:
+                yield dict(list(zip(column_names, row)))
+        return
+
+    while True:
+        rows = cur.fetchmany(fetch_size)
+        if rows:
+            column_names = [desc[0] for desc in cur.description]
+            for row in rows:
+                yield dict(list(zip(column_names, row)))
+        if len(rows) < fetch_size:
+            break
+
+
+def json_default(v):
+    """
+    Serialises values that json.dumps can't handle by itself (e.g., dates)
+    when writing result rows to a spool file.
+    """
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return str(v)
+
+
+class Spool(object):
+    """
+    Writes records (result rows) to a gzip-compressed JSON Lines file, which
+    may be shared between threads. In check mode, the file is not created,
+    and the records are discarded.
+    """
+
+    def __init__(self, path, check_mode=False):
+        self.raw = self.file = None
+        if not check_mode:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            self.raw = os.fdopen(fd, "wb")
+            self.file = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        if self.file is None:
+            return
+        line = json.dumps(record, default=json_default) + "\n"
+        with self.lock:
+            self.file.write(line.encode("utf-8"))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.raw.close()
+
+
+def execute_queries(conn, queries, params, spool=None, datname=None):
+    """
+    Executes the given queries on conn, without committing or rolling back
+    the transaction, and returns a dict with the results, rowcounts, etc.
+    """
+    autocommit = params["autocommit"]
+    fetch_size = params["fetch_size"]
+    max_rows = params["max_rows"]
+
+    r = dict(
+        changed=False,
+        results=[],
+        runtimes=[],
+        rowcounts=[],
+        truncated=[],
+        spooled_rows=[],
+        plans=[],
+    )
+
+    # A batch is executed as a single statement, so the module-level timeouts
+    # apply to the whole batch. We report the same rowcounts as we would for
+    # each query on its own: -1 for a utility statement (for which ROW_COUNT
+    # is always 0), which is always a change, and the number of rows for any
+    # other statement, which is a change only if it doesn't return rows.
+    if params["batch"]:
+        timeouts, explain = get_query_settings({}, params)
+        cur = conn.cursor()
+        set_timeouts(cur, timeouts)
+        rowcounts, runtimes = execute_batch(conn, queries)
+        reset_timeouts(cur, timeouts)
+        cur.close()
+        for i, q in enumerate(queries):
+            kind = statement_kind(get_query(q)[0])
+            if kind == "utility":
+                rowcounts[i] = -1
+            if kind == "utility" or (kind == "dml" and rowcounts[i]):
+                r["changed"] = True
+        r["rowcounts"] = rowcounts
+        r["runtimes"] = [round(t, 6) for t in runtimes]
+        r["results"] = [[] for q in queries]
+        return r
+
+    for i, q in enumerate(queries):
+        timeouts, explain = get_query_settings(q, params)
+        text, args = get_query(q)
+
+        # We set any timeouts, and obtain the plan, on an ordinary cursor.
+        plan = None
+        settings_cur = conn.cursor()
+        set_timeouts(settings_cur, timeouts)
+        if explain == "plan":
+            plan = explain_query(settings_cur, text, args)
+
+        # A named cursor is a server-side cursor, from which we fetch rows as
+        # we go. It must be declared WITH HOLD to survive the end of the
+        # transaction in autocommit mode. It can't be used for EXPLAIN.
+        streaming = fetch_size and explain != "analyze"
+        if streaming:
+            cur = conn.cursor(name="postgresql_query_%d" % i, withhold=autocommit)
+        else:
+            cur = conn.cursor()
+
+        starttime = clock()
+        if explain == "analyze":
+            plan = explain_query(cur, text, args, analyze=True)
+        else:
+            cur.execute(text, args)
+        runtime = round(clock() - starttime, 6)
+
+        # EXPLAIN ANALYZE returns the plan instead of the query's results,
+        # and we can't tell how many rows it affected, but the presence of
+        # an Operation shows that it was a data-modifying statement.
+        if explain == "analyze":
+            if plan and "Operation" in plan[0].get("Plan", {}):
+                r["changed"] = True
+            reset_timeouts(settings_cur, timeouts)
+            settings_cur.close()
+            cur.close()
+            r["rowcounts"].append(-1)
+            r["results"].append([])
+            r["runtimes"].append(runtime)
+            r["truncated"].append(False)
+            r["spooled_rows"].append(0)
+            r["plans"].append(plan)
+            continue
+
+        res = []
+        n = 0
+        more = False
+        for row in stream_rows(cur, fetch_size if streaming else None):
+            if max_rows is not None and n >= max_rows:
+                more = True
+                break
+            n += 1
+            if spool:
+                record = {"query": i, "row": row}
+                if datname is not None:
+                    record = dict(database=datname, **record)
+                spool.write(record)
+            else:
+                res.append(row)
+
+        # The rowcount of a named cursor reflects only the last fetch, so we
+        # count the rows ourselves, and include the time spent fetching them
+        # in the runtime.
+        rowcount = cur.rowcount
+        if streaming:
+            rowcount = n
+            runtime = round(clock() - starttime, 6)
+        elif cur.description is None and cur.rowcount:
+            r["changed"] = True
+
+        # The timeouts apply to each FETCH from a named cursor too, so we
+        # reset them only after reading the rows.
+        cur.close()
+        reset_timeouts(settings_cur, timeouts)
+        settings_cur.close()
+
+        r["rowcounts"].append(rowcount)
+        r["results"].append(res)
+        r["runtimes"].append(runtime)
+        r["truncated"].append(more)
+        r["spooled_rows"].append(n if spool else 0)
+        r["plans"].append(plan)
+
+    return r
+
+
+def get_databases(conn, databases):
+    """
+    Returns the list of database names to connect to, given a list of names,
+    or ["all"] to mean every database that accepts connections.
+    """
+    if "all" not in databases:
+        return databases
+    if len(databases) > 1:
+        raise ValueError("databases: 'all' cannot be combined with other names")
+
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT datname FROM pg_database
+        WHERE datallowconn AND NOT datistemplate
+            AND datname <> 'bdr_supervisordb'
+        ORDER BY datname
+        """
+    )
+    datnames = [row[0] for row in cur]
+    cur.close()
+    conn.rollback()
+    return datnames
+
+
+def execute_everywhere(module, conninfo, datnames, queries, spool):
+    """
+    Executes the queries in each of the given databases, using up to
+    `workers` connections in parallel. The transaction in each database is
+    committed only if the queries succeed in all of them; otherwise, all of
+    them are rolled back, and a (datname, exception, traceback) tuple for
+    the first failure (in the given order) is returned along with the
+    results of the databases that succeeded.
+    """
+    params = module.params
+
+    def execute(datname):
+        conn = None
+        try:
+            conn = psycopg2.connect(dsn=make_dsn(conninfo, dbname=datname))
+            if params["autocommit"]:
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            r = execute_queries(conn, queries, params, spool, datname)
+            return conn, r, None
+        except Exception as e:
+            return conn, None, (datname, e, traceback.format_exc())
+
+    workers = min(params["workers"], len(datnames))
+    if workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            executed = pool.map(execute, datnames)
+        finally:
+            pool.terminate()
+    else:
+        executed = [execute(datname) for datname in datnames]
+
+    failures = [failure for conn, r, failure in executed if failure]
+
+    try:
+        for conn, r, failure in executed:
+            if conn is None:
+                continue
+            if failures or module.check_mode:
+                try:
+                    conn.rollback()
+                except psycopg2.InterfaceError:
+                    pass
+            else:
+                conn.commit()
+    finally:
+        for conn, r, failure in executed:
+            if conn is not None:
+                conn.close()
+
+    results = dict(
+        (datname, r) for datname, (conn, r, failure) in zip(datnames, executed) if r
+    )
+    return results, (failures[0] if failures else None)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -203,6 +822,15 @@ def main():
             queries=dict(type="list"),
             query=dict(type="str"),
             autocommit=dict(type="bool", default=False),
+            batch=dict(type="bool", default=False),
+            fetch_size=dict(type="int"),
+            max_rows=dict(type="int"),
+            spool=dict(type="path"),
+            statement_timeout=dict(type="str"),
+            lock_timeout=dict(type="str"),
+            explain=dict(type="str", choices=["analyze", "plan"]),
+            databases=dict(type="list"),
+            workers=dict(type="int", default=4),
         ),
         required_one_of=[["query", "queries"]],
         mutually_exclusive=[["query", "queries"]],
@@ -213,7 +841,6 @@ def main():
         module.fail_json(msg="the python psycopg2 module is required")
 
     m = dict()
-    changed = False
 
     queries = get_queries(module)
     m["queries"] = queries
@@ -232,39 +859,102 @@ def main():
         )
 
     autocommit = module.params["autocommit"]
+    batch = module.params["batch"]
+    if batch and autocommit:
+        module.fail_json(msg="batch cannot be used with autocommit", **m)
+
+    fetch_size = module.params["fetch_size"]
+    max_rows = module.params["max_rows"]
+    spool_path = module.params["spool"]
+    if batch and (fetch_size or max_rows is not None or spool_path):
+        module.fail_json(
+            msg="batch cannot be used with fetch_size, max_rows, or spool", **m
+        )
+
+    explain = module.params["explain"]
+    per_query = ["explain"] + TIMEOUTS
+    if batch and (
+        explain
+        or any(isinstance(q, dict) and k in q for q in queries for k in per_query)
+    ):
+        module.fail_json(
+            msg="batch cannot be used with explain or per-query timeouts", **m
+        )
+    explained = explain or any(
+        isinstance(q, dict) and q.get("explain") for q in queries
+    )
+
+    databases = module.params["databases"]
+    if databases:
+        try:
+            datnames = get_databases(conn, databases)
+        except Exception as e:
+            module.fail_json(
+                msg="Could not list databases",
+                err=str(e),
+                exception=traceback.format_exc(),
+                **m
+            )
+        finally:
+            conn.close()
+        m["databases"] = datnames
+
+        spool = Spool(spool_path, module.check_mode) if spool_path else None
+        try:
+            everywhere, failure = execute_everywhere(
+                module, conninfo, datnames, queries, spool
+            )
+        finally:
+            if spool:
+                spool.close()
+
+        if failure:
+            datname, e, tb = failure
+            m["failed_database"] = datname
+            if isinstance(e, BatchError):
+                m["failed_query"] = e.index
+                m["failed_query_text"] = get_query(queries[e.index])[0]
+            module.fail_json(msg="Database query failed", err=str(e), exception=tb, **m)
+
+        # We return a dict keyed by database name for each of the values we
+        # would otherwise have returned for a single database.
+
+        changed = any(r["changed"] for r in everywhere.values())
+        results = dict()
+        for datname in datnames:
+            r = everywhere[datname]
+            res = r["results"]
+            results[datname] = res[0] if len(res) == 1 else res
+        m["runtimes"] = dict((d, everywhere[d]["runtimes"]) for d in datnames)
+        m["rowcounts"] = dict((d, everywhere[d]["rowcounts"]) for d in datnames)
+        if max_rows is not None:
+            m["truncated"] = dict((d, everywhere[d]["truncated"]) for d in datnames)
+        if spool_path:
+            m["spool"] = spool_path
+            m["spooled_rows"] = dict(
+                (d, everywhere[d]["spooled_rows"]) for d in datnames
+            )
+        if explained:
+            m["plans"] = dict((d, everywhere[d]["plans"]) for d in datnames)
+
+        module.exit_json(changed=changed, results=results, **m)
+
     if autocommit:
         conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
 
-    results = []
-    runtimes = []
-    rowcounts = []
+    spool = None
     try:
-        for q in queries:
-            cur = conn.cursor()
-
-            text, args = get_query(q)
-
-            starttime = time.time()
-            cur.execute(text, args)
-            runtime = round(time.time() - starttime, 3)
-
-            res = []
-            if cur.description is not None:
-                column_names = [desc[0] for desc in cur.description]
-                for row in cur:
-                    res.append(dict(list(zip(column_names, row))))
-            elif cur.rowcount:
-                changed = True
-
-            rowcounts.append(cur.rowcount)
-            results.append(res)
-            runtimes.append(runtime)
-            cur.close()
+        if spool_path:
+            spool = Spool(spool_path, module.check_mode)
+        r = execute_queries(conn, queries, module.params, spool)
     except Exception as e:
         try:
             conn.rollback()
         except psycopg2.InterfaceError:
             pass
+        if isinstance(e, BatchError):
+            m["failed_query"] = e.index
+            m["failed_query_text"] = get_query(queries[e.index])[0]
         module.fail_json(
             msg="Database query failed",
             err=str(e),
@@ -276,6 +966,14 @@ def main():
             conn.rollback()
         else:
             conn.commit()
+    finally:
+        if spool:
+            spool.close()
+
+    changed = r["changed"]
+    results = r["results"]
+    runtimes = r["runtimes"]
+    rowcounts = r["rowcounts"]
 
     if len(results) == 1:
         results = results[0]
@@ -288,6 +986,15 @@ def main():
     m["rowcounts"] = rowcounts
     if len(rowcounts) == 1:
         m["rowcount"] = rowcounts[0]
+    if max_rows is not None:
+        m["truncated"] = r["truncated"]
+    if spool_path:
+        m["spool"] = spool_path
+        m["spooled_rows"] = r["spooled_rows"]
+    if explained:
+        m["plans"] = r["plans"]
+        if len(r["plans"]) == 1:
+            m["plan"] = r["plans"][0]
 
     module.exit_json(changed=changed, results=results, **m)
 
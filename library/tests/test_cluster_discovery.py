@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+#  © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+import pytest
+
+from cluster_discovery import (
+    SECTIONS,
+    ConnectionPool,
+    FactsCache,
+    Timings,
+    database_discovery,
+    json_facts,
+    oids_to_int,
+    resolve_sections,
+    server_facts,
+)
+
+
+@pytest.fixture
+def connect(mocker):
+    def new_connection(dsn):
+        conn = mocker.MagicMock(name=dsn)
+        conn.closed = 0
+
+        def close():
+            conn.closed = 1
+
+        conn.close.side_effect = close
+        return conn
+
+    return mocker.patch(
+        "cluster_discovery.psycopg2.connect", side_effect=new_connection
+    )
+
+
+class TestConnectionPool:
+    def test_connection_is_reused(self, connect):
+        pool = ConnectionPool("host=/tmp", 2)
+        with pool.connection("a") as c1:
+            pass
+        with pool.connection("a") as c2:
+            pass
+        assert c1 is c2
+        assert connect.call_count == 1
+        connect.assert_called_with("host=/tmp dbname=a")
+        c1.rollback.assert_called()
+
+    def test_idle_connections_are_evicted(self, connect):
+        pool = ConnectionPool("", 2)
+        with pool.connection("a") as a:
+            pass
+        with pool.connection("b") as b:
+            pass
+        with pool.connection("c") as c:
+            pass
+        assert a.closed and not b.closed and not c.closed
+        assert list(pool.idle) == ["b", "c"]
+
+    def test_failed_connection_is_discarded(self, connect):
+        pool = ConnectionPool("", 1)
+        with pytest.raises(ValueError):
+            with pool.connection("a") as a:
+                raise ValueError("oops")
+        assert a.closed
+        assert not pool.idle
+        assert pool.in_use == 0
+
+    def test_close(self, connect):
+        pool = ConnectionPool("", 4)
+        conns = []
+        for datname in ["a", "b", "c"]:
+            with pool.connection(datname) as conn:
+                conns.append(conn)
+        pool.close()
+        assert all(conn.closed for conn in conns)
+        assert not pool.idle
+
+
+class TestDatabaseDiscovery:
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_results_in_pg_database_order(self, connect, mocker, workers):
+        datnames = ["postgres", "template0", "bdrdb", "app", "template1"]
+        facts = {"pg_database": [{"datname": d, "encoding": "UTF8"} for d in datnames]}
+        mocker.patch("cluster_discovery.database_facts", return_value={})
+        mocker.patch("cluster_discovery.schema_discovery", return_value={})
+        mocker.patch("cluster_discovery.extension_discovery", return_value={})
+        mocker.patch("cluster_discovery.pglogical_discovery", return_value={})
+
+        def bdr_discovery(module, conn, m0, facts):
+            datname = conn._mock_name.split("=")[-1]
+            return {"bdr": {"node_group": [datname]}}
+
+        mocker.patch("cluster_discovery.bdr_discovery", side_effect=bdr_discovery)
+
+        pool = ConnectionPool("", workers)
+        m = database_discovery(
+            None, None, {}, facts, pool, set(SECTIONS), FactsCache("")
+        )
+        pool.close()
+
+        assert list(m["databases"]) == datnames
+        assert m["bdr_databases"] == ["postgres", "bdrdb", "app", "template1"]
+        assert "bdr" not in m["databases"]["template0"]
+        assert m["databases"]["app"] == {
+            "datname": "app",
+            "encoding": "UTF8",
+            "bdr": {"node_group": ["app"]},
+        }
+        assert sorted(facts["databases"]) == sorted(m["bdr_databases"])
+
+
+class TestOidsToInt:
+    def test_oids_to_int(self):
+        rows = [
+            {"oid": "10", "extconfig": ["16390", "16391"], "extname": "x"},
+            {"oid": "11", "extconfig": None, "extname": "y"},
+        ]
+        oids_to_int(rows, ["oid", "extconfig", "missing"])
+        assert rows == [
+            {"oid": 10, "extconfig": [16390, 16391], "extname": "x"},
+            {"oid": 11, "extconfig": None, "extname": "y"},
+        ]
+
+
+class TestResolveSections:
+    def test_all(self):
+        assert resolve_sections(["all"]) == set(SECTIONS)
+        assert resolve_sections(["roles", "all"]) == set(SECTIONS)
+
+    def test_dependencies(self):
+        assert resolve_sections(["replication"]) == {"replication"}
+        assert resolve_sections(["bdr", "roles"]) == {"bdr", "databases", "roles"}
+
+    def test_unknown(self):
+        with pytest.raises(ValueError, match="unknown sections: nodes"):
+            resolve_sections(["bdr", "nodes"])
+
+
+@pytest.mark.parametrize("version, lastsysoid", [(140000, True), (150000, False)])
+def test_pg_database_columns(mocker, version, lastsysoid):
+    conn = mocker.MagicMock(server_version=version)
+    cache = mocker.MagicMock()
+    cache.json_facts.return_value = {"pg_database": []}
+    server_facts(conn, {"databases"}, cache)
+    query = cache.json_facts.call_args[0][1]["pg_database"]
+    assert "*" not in query
+    assert query.count(" as encoding") == query.count("encoding,") == 1
+    assert ("datlastsysoid" in query) is lastsysoid
+
+
+def test_json_facts_values(mocker):
+    conn = mocker.MagicMock()
+    cur = conn.cursor.return_value
+    cur.fetchone.return_value = [{"a": 1, "a_fp": "x"}]
+    facts = json_facts(
+        conn, {"a": "f(a_fp.value)", "a_fp": "a_fp.value"}, {"a_fp": "fp"}
+    )
+    assert facts == {"a": 1, "a_fp": "x"}
+    sql = cur.execute.call_args[0][0]
+    assert sql.endswith(" FROM (SELECT fp AS value OFFSET 0) a_fp")
+    assert sql.count("fp AS value") == 1
+
+
+class TestFactsCache:
+    def test_disabled(self, mocker):
+        json_facts = mocker.patch(
+            "cluster_discovery.json_facts", return_value={"roles": []}
+        )
+        cache = FactsCache("")
+        facts = cache.json_facts(None, {"roles": "x"}, {"roles": "fp"})
+        assert facts == {"roles": []}
+        json_facts.assert_called_once_with(None, {"roles": "x"})
+        cache.save()
+
+    def test_reuse_and_refresh(self, mocker, tmp_path):
+        path = str(tmp_path / "cache.json")
+        fp1, fp2 = "a" * 32, "b" * 32
+
+        json_facts = mocker.patch(
+            "cluster_discovery.json_facts",
+            return_value={"roles": ["r1"], "roles_fingerprint": fp1, "x": 1},
+        )
+        cache = FactsCache(path)
+        facts = cache.json_facts(None, {"roles": "q", "x": "1"}, {"roles": "fp"})
+        assert facts == {"roles": ["r1"], "x": 1}
+        cache.save()
+
+        # The fingerprint is unchanged, so the server returns NULL instead of
+        # evaluating the expression, and we use the remembered value.
+        json_facts.return_value = {"roles": None, "roles_fingerprint": fp1, "x": 1}
+        cache = FactsCache(path)
+        facts = cache.json_facts(None, {"roles": "q", "x": "1"}, {"roles": "fp"})
+        assert facts == {"roles": ["r1"], "x": 1}
+        conn, exprs, values = json_facts.call_args[0]
+        assert exprs["roles"] == (
+            "CASE WHEN roles_fingerprint.value = '%s' THEN NULL ELSE q END" % fp1
+        )
+        assert exprs["roles_fingerprint"] == "roles_fingerprint.value"
+        assert values == {"roles_fingerprint": "fp"}
+
+        json_facts.return_value = {"roles": ["r2"], "roles_fingerprint": fp2}
+        facts = cache.json_facts(None, {"roles": "q"}, {"roles": "fp"})
+        assert facts == {"roles": ["r2"]}
+
+    def test_databases(self, mocker, tmp_path):
+        mocker.patch(
+            "cluster_discovery.json_facts",
+            side_effect=lambda conn, exprs, values: {
+                "schemas": [],
+                "schemas_fingerprint": "c" * 32,
+            },
+        )
+        cache = FactsCache(str(tmp_path / "cache.json"))
+        for datname in ["a", "b", "server"]:
+            cache.json_facts(None, {"schemas": "q"}, {"schemas": "fp"}, datname)
+        cache.forget_databases_except(["b"])
+        assert sorted(cache.scopes) == ["database:b"]
+
+    def test_invalid_file(self, tmp_path):
+        path = tmp_path / "cache.json"
+        path.write_text("{not json")
+        assert FactsCache(str(path)).scopes == {}
+
+
+class TestTimings:
+    def test_disabled(self):
+        t = Timings()
+        with t.measure("f"):
+            t.count(queries=1, rows=2)
+        assert t.functions == {}
+
+    def test_nested(self):
+        t = Timings()
+        t.enabled = True
+        with t.measure("outer"):
+            t.count(queries=1, rows=5)
+            for i in range(2):
+                with t.measure("inner"):
+                    t.count(queries=2, rows=i)
+        t.count(queries=1)
+
+        assert t.functions["outer"]["calls"] == 1
+        assert t.functions["outer"]["queries"] == 1
+        assert t.functions["outer"]["rows"] == 5
+        assert t.functions["inner"]["calls"] == 2
+        assert t.functions["inner"]["queries"] == 4
+        assert t.functions["inner"]["rows"] == 1
+        assert t.functions["outer"]["duration"] >= t.functions["inner"]["duration"]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+#  © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+import shutil
+
+import pytest
+
+from hosts_lines import hosts_lines
+
+HOSTS = """127.0.0.1 localhost
+# 192.0.2.1 one
+192.0.2.1 one.example.com one
+192.0.2.2 two
+192.0.2.9 other
+"""
+
+
+@pytest.fixture
+def module(mocker):
+    module = mocker.MagicMock()
+    module.check_mode = False
+    module._diff = False
+    module.params = dict(path=None, lines=None, files=None, platform=None)
+    module.atomic_move.side_effect = lambda src, dst, **kwargs: shutil.move(src, dst)
+    module.fail_json.side_effect = lambda **kwargs: pytest.fail(kwargs["msg"])
+    return module
+
+
+@pytest.fixture
+def hosts(tmp_path):
+    path = tmp_path / "hosts"
+    path.write_text(HOSTS)
+    return path
+
+
+def run(module, path, lines):
+    module.params.update(path=str(path), lines=lines)
+    return hosts_lines(module)
+
+
+class TestHostsLines:
+    def test_unchanged(self, module, hosts):
+        m = run(module, hosts, ["192.0.2.2 two", "127.0.0.1 localhost"])
+        assert m == {"changed": False}
+        assert hosts.read_text() == HOSTS
+
+    def test_append(self, module, hosts):
+        m = run(module, hosts, ["192.0.2.4 four", "192.0.2.3 three"])
+        assert m == {"changed": True, "operation": "append"}
+        assert hosts.read_text() == HOSTS + "192.0.2.4 four\n192.0.2.3 three\n"
+
+    def test_append_unterminated(self, module, hosts):
+        hosts.write_text("127.0.0.1 localhost")
+        run(module, hosts, ["192.0.2.3 three"])
+        assert hosts.read_text() == "127.0.0.1 localhost\n192.0.2.3 three\n"
+
+    def test_replace(self, module, hosts):
+        module._diff = True
+        m = run(module, hosts, ["192.0.2.1 one", "192.0.2.2 two", "192.0.2.2 two"])
+        assert m["changed"] and m["operation"] == "replace"
+        expected = HOSTS.replace("192.0.2.1 one.example.com one\n", "")
+        expected += "192.0.2.1 one\n"
+        assert hosts.read_text() == expected
+        assert m["diff"][0]["before"] == HOSTS
+        assert m["diff"][0]["after"] == expected
+
+    def test_read_once(self, module, hosts, mocker):
+        opened = mocker.patch("hosts_lines.open", wraps=open, create=True)
+        run(module, hosts, ["192.0.2.1 one"])
+        assert [c[0][1] for c in opened.call_args_list] == ["r"]
+
+    def test_duplicates_removed(self, module, hosts):
+        hosts.write_text("192.0.2.2 two\n192.0.2.2 two\n")
+        m = run(module, hosts, ["192.0.2.2 two"])
+        assert m["changed"]
+        assert hosts.read_text() == "192.0.2.2 two\n"
+
+    def test_overwrite_in_docker(self, module, hosts):
+        module.params["platform"] = "docker"
+        m = run(module, hosts, ["192.0.2.9 nine"])
+        assert m["operation"] == "overwrite"
+        assert hosts.read_text().endswith("192.0.2.2 two\n192.0.2.9 nine\n")
+        module.atomic_move.assert_not_called()
+
+    def test_check_mode(self, module, hosts):
+        module.check_mode = True
+        assert run(module, hosts, ["192.0.2.1 uno"]) == {"changed": True}
+        assert hosts.read_text() == HOSTS
+
+    def test_files(self, module, hosts, tmp_path):
+        other = tmp_path / "hosts.tmpl"
+        other.write_text("192.0.2.2 two\n")
+        module._diff = True
+        module.params["files"] = [
+            dict(path=str(hosts), lines=["192.0.2.2 two"]),
+            dict(path=str(other), lines=["192.0.2.3 three"]),
+        ]
+        m = hosts_lines(module)
+        assert m["changed"]
+        assert [f["changed"] for f in m["files"]] == [False, True]
+        assert [f["path"] for f in m["files"]] == [str(hosts), str(other)]
+        assert len(m["diff"]) == 2
+        assert other.read_text() == "192.0.2.2 two\n192.0.2.3 three\n"
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+#  © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+import pytest
+
+from linesinfile import linesinfile
+
+
+@pytest.fixture
+def module(mocker):
+    module = mocker.MagicMock()
+    module.check_mode = False
+    module._diff = False
+    module.params = dict(path=None, lines=None, files=None)
+    module.fail_json.side_effect = lambda **kwargs: pytest.fail(kwargs["msg"])
+    return module
+
+
+class TestLinesInFile:
+    def test_append(self, module, tmp_path):
+        path = tmp_path / "sysctl.conf"
+        path.write_text("a=1\nb=2")
+        module._diff = True
+        module.params.update(path=str(path), lines=["c=3", "a=1", "d=4", "c=3"])
+
+        m = linesinfile(module)
+        assert m["changed"]
+        assert path.read_text() == "a=1\nb=2\nc=3\nd=4\n"
+        assert m["diff"][0]["before"] == "a=1\nb=2"
+        assert m["diff"][0]["after"] == "a=1\nb=2\nc=3\nd=4\n"
+
+    def test_unchanged(self, module, tmp_path):
+        path = tmp_path / "sysctl.conf"
+        path.write_text("a=1\nb=2\n")
+        module.params.update(path=str(path), lines=["b=2"])
+        assert linesinfile(module) == {"changed": False}
+
+    def test_files(self, module, tmp_path):
+        one, two = tmp_path / "one", tmp_path / "two"
+        one.write_text("x\n")
+        module.check_mode = True
+        module.params["files"] = [
+            dict(path=str(one), lines=["x"]),
+            dict(path=str(two), lines=["y"]),
+        ]
+
+        m = linesinfile(module)
+        assert m == {
+            "changed": True,
+            "files": [
+                {"changed": False, "path": str(one)},
+                {"changed": True, "path": str(two)},
+            ],
+        }
+        assert two.read_text() == ""
+
+    def test_invalid_files(self, module):
+        module.params["files"] = [{"path": "/tmp/x"}]
+        with pytest.raises(pytest.fail.Exception, match="path and lines"):
+            linesinfile(module)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+#  © Copyright EnterpriseDB UK Limited 2015-2023 - All rights reserved.
+
+import datetime
+import gzip
+import json
+
+import psycopg2
+import pytest
+
+from postgresql_query import (
+    BatchError,
+    Spool,
+    execute_batch,
+    execute_everywhere,
+    execute_queries,
+    get_query_settings,
+    statement_kind,
+    stream_rows,
+)
+
+
+class TestGetQuerySettings:
+    params = dict(statement_timeout="10min", lock_timeout=None, explain="plan")
+
+    def test_defaults(self):
+        assert get_query_settings("SELECT 1", self.params) == (
+            {"statement_timeout": "10min"},
+            "plan",
+        )
+
+    def test_overrides(self):
+        q = dict(text="SELECT 1", lock_timeout=500, explain=False)
+        assert get_query_settings(q, self.params) == (
+            {"statement_timeout": "10min", "lock_timeout": "500"},
+            None,
+        )
+
+    def test_invalid_explain(self):
+        with pytest.raises(ValueError, match="explain must be one of"):
+            get_query_settings(dict(text="x", explain="verbose"), self.params)
+
+
+def mogrify(text, args=None):
+    """Interpolates args into text as psycopg2 would, quoting each one."""
+    if args:
+        text = text % tuple("'%s'" % str(a).replace("'", "''") for a in args)
+    return text.encode("utf-8")
+
+
+class QueryError(psycopg2.Error):
+    def __init__(self, hint):
+        super(QueryError, self).__init__("query failed")
+        self.hint = hint
+
+    @property
+    def diag(self):
+        return type("Diag", (), {"message_hint": self.hint})
+
+
+class TestExecuteBatch:
+    def conn(self, mocker, batch=None, error=None):
+        conn = mocker.MagicMock()
+        conn.encoding = "UTF8"
+        cur = conn.cursor.return_value
+        cur.mogrify.side_effect = mogrify
+        cur.execute.side_effect = error
+        cur.fetchone.return_value = [json.dumps(batch)]
+        return conn
+
+    def executed_sql(self, conn):
+        return conn.cursor.return_value.execute.call_args[0][0]
+
+    def test_do_block(self, mocker):
+        conn = self.conn(mocker, {"rowcounts": [1, 2], "runtimes": [0.1, 0.2]})
+        queries = ["SELECT 'a'", dict(text="UPDATE t SET x = %s", args=["it's"])]
+        assert execute_batch(conn, queries) == ([1, 2], [0.1, 0.2])
+
+        sql = self.executed_sql(conn)
+        assert "DO $batch$" in sql
+        assert "EXECUTE 'SELECT ''a''';" in sql
+        assert "EXECUTE 'UPDATE t SET x = ''it''''s''';" in sql
+        assert sql.index("i := 0;") < sql.index("i := 1;")
+        assert "SELECT current_setting('tpa.batch')" in sql
+
+    def test_dollar_quote_tag(self, mocker):
+        conn = self.conn(mocker, {"rowcounts": [0], "runtimes": [0.0]})
+        execute_batch(conn, ["SELECT $batch$x$batch$"])
+
+        sql = self.executed_sql(conn)
+        tag = sql.split("DO ", 1)[1].split()[0]
+        assert tag.startswith("$batch_") and tag.endswith("$")
+        assert sql.count(tag) == 2
+
+    def test_failed_query(self, mocker):
+        conn = self.conn(mocker, error=QueryError("batch query 1"))
+        with pytest.raises(BatchError) as e:
+            execute_batch(conn, ["SELECT 1", "SELECT x", "SELECT 3"])
+        assert e.value.index == 1
+        assert str(e.value) == "query failed"
+
+    def test_other_error(self, mocker):
+        conn = self.conn(mocker, error=QueryError(None))
+        with pytest.raises(QueryError):
+            execute_batch(conn, ["SELECT 1"])
+
+
+@pytest.mark.parametrize(
+    "text, kind",
+    [
+        ("SELECT 1", "rows"),
+        ("  (select 1) UNION (select 2)", "rows"),
+        ("-- comment\n/* x */ VALUES (1)", "rows"),
+        ("INSERT INTO t VALUES (1)", "dml"),
+        ("delete from t returning *", "rows"),
+        ("WITH x AS (SELECT 1) UPDATE t SET a = 1", "dml"),
+        ("WITH x AS (SELECT 1) SELECT * FROM x", "rows"),
+        ("CREATE ROLE app", "utility"),
+        ("GRANT CONNECT ON DATABASE app TO app", "utility"),
+    ],
+)
+def test_statement_kind(text, kind):
+    assert statement_kind(text) == kind
+
+
+class TestExecuteQueriesBatch:
+    params = dict(
+        autocommit=False,
+        batch=True,
+        fetch_size=None,
+        max_rows=None,
+        explain=None,
+        statement_timeout=None,
+        lock_timeout=None,
+    )
+
+    @pytest.mark.parametrize(
+        "queries, rowcounts, expected, changed",
+        [
+            (["SELECT 1", "UPDATE t SET a = 1"], [1, 0], [1, 0], False),
+            (["SELECT 1", "UPDATE t SET a = 1"], [1, 3], [1, 3], True),
+            (["CREATE ROLE app", "GRANT x TO app"], [0, 0], [-1, -1], True),
+        ],
+    )
+    def test_changed(self, mocker, queries, rowcounts, expected, changed):
+        mocker.patch(
+            "postgresql_query.execute_batch", return_value=(rowcounts, [0.1, 0.2])
+        )
+        r = execute_queries(mocker.MagicMock(), queries, self.params)
+        assert r["rowcounts"] == expected
+        assert r["changed"] is changed
+
+
+class TestStreamRows:
+    def test_named_cursor(self, mocker):
+        cur = mocker.MagicMock()
+        cur.description = [("a",), ("b",)]
+        cur.fetchmany.side_effect = [[(1, 2), (3, 4)], [(5, 6)]]
+        rows = list(stream_rows(cur, 2))
+        assert rows == [{"a": 1, "b": 2}, {"a": 3, "b": 4}, {"a": 5, "b": 6}]
+        assert cur.fetchmany.call_count == 2
+
+    def test_no_results(self, mocker):
+        cur = mocker.MagicMock()
+        cur.description = None
+        assert list(stream_rows(cur)) == []
+
+
+class TestSpool:
+    def test_write(self, tmp_path):
+        path = str(tmp_path / "rows.jsonl.gz")
+        spool = Spool(path)
+        spool.write({"query": 0, "row": {"d": datetime.date(2023, 1, 2)}})
+        spool.write({"query": 1, "row": {"x": 1}})
+        spool.close()
+
+        with gzip.open(path, "rt") as f:
+            lines = [json.loads(line) for line in f]
+        assert lines == [
+            {"query": 0, "row": {"d": "2023-01-02"}},
+            {"query": 1, "row": {"x": 1}},
+        ]
+        assert (tmp_path / "rows.jsonl.gz").stat().st_mode & 0o777 == 0o600
+
+    def test_check_mode(self, tmp_path):
+        spool = Spool(str(tmp_path / "rows.jsonl.gz"), check_mode=True)
+        spool.write({"query": 0, "row": {"x": 1}})
+        spool.close()
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestExecuteEverywhere:
+    def module(self, mocker, workers):
+        module = mocker.MagicMock()
+        module.check_mode = False
+        module.params = dict(
+            autocommit=False,
+            batch=False,
+            fetch_size=None,
+            max_rows=None,
+            workers=workers,
+        )
+        return module
+
+    def test_results_by_database(self, mocker):
+        conns = dict()
+
+        def connect(dsn):
+            conns[dsn] = mocker.MagicMock(name=dsn)
+            return conns[dsn]
+
+        mocker.patch("postgresql_query.psycopg2.connect", side_effect=connect)
+        mocker.patch(
+            "postgresql_query.execute_queries",
+            side_effect=lambda conn, queries, params, spool, datname: datname,
+        )
+
+        datnames = ["a", "b", "c"]
+        results, failure = execute_everywhere(
+            self.module(mocker, 2), "host=/tmp", datnames, ["SELECT 1"], None
+        )
+        assert failure is None
+        assert results == {"a": "a", "b": "b", "c": "c"}
+        assert len(conns) == 3
+        for conn in conns.values():
+            conn.commit.assert_called_once()
+            conn.close.assert_called_once()
+
+    def test_failure_rolls_back_everywhere(self, mocker):
+        conns = []
+
+        def connect(dsn):
+            conns.append(mocker.MagicMock(name=dsn))
+            return conns[-1]
+
+        def execute_queries(conn, queries, params, spool, datname):
+            if datname == "b":
+                raise ValueError("oops")
+            return datname
+
+        mocker.patch("postgresql_query.psycopg2.connect", side_effect=connect)
+        mocker.patch("postgresql_query.execute_queries", side_effect=execute_queries)
+
+        results, failure = execute_everywhere(
+            self.module(mocker, 1), "", ["a", "b", "c"], ["SELECT 1"], None
+        )
+        assert results == {"a": "a", "c": "c"}
+        assert failure[0] == "b"
+        assert str(failure[1]) == "oops"
+        for conn in conns:
+            conn.commit.assert_not_called()
+            conn.rollback.assert_called_once()
+            conn.close.assert_called_once()